@@ -1,15 +1,21 @@
 import os, os.path
 import csv
+import functools
 import math
 import numpy
 import gzip
-from isodist.Isochrone import Isochrone, FEH2Z, Z2FEH, dict2recarray
+from isodist.Isochrone import Isochrone, FEH2Z, Z2FEH, dict2recarray, \
+    _IsochroneTables
 from isodist.PadovaIsochrone import _DATADIR
+from isodist._cache import cached_read
 _ANZSOLAR= 0.0176
 _ZS= [-0.1,-0.2,-0.3,-0.5,-1.,-1.5,-2.,-3.,0.,0.1,0.2,0.4]
 class AnIsochrone (Isochrone):
     """Class that represents a An+08 isochrone"""
-    def __init__(self,Z=None,filters=None,corrected=True):
+    _masskey= 'Mass'
+    _zsolar= _ANZSOLAR
+    def __init__(self,Z=None,filters=None,corrected=True,diskcache=False,
+                 lazy=False,n_workers=None,executor=None):
         """
         NAME:
            __init__
@@ -18,6 +24,15 @@ class AnIsochrone (Isochrone):
         INPUT:
            corrected= if False, use un-corrected isochrones
            Z= load only this metallicity (can be list)
+           diskcache= (False) if True, cache the parsed tables in binary
+                      form ($ISODIST_CACHE or next to the data), if a
+                      string, cache them in this directory
+           lazy= (False) if True, only read the isochrones for a 
+                 metallicity when they are first needed
+           n_workers= (None) if set, read the files for the different
+                      metallicities in parallel with this many processes
+           executor= (None) if set, read the files in parallel with this
+                     executor or pool (e.g., a ThreadPoolExecutor)
         OUTPUT:
         HISTORY:
            2011-08-05 - Written - Bovy (NYU)
@@ -25,8 +40,8 @@ class AnIsochrone (Isochrone):
            Z determination needs to account for dY/dZ
         """
         self._filters= ['u','g','r','i','z']
-        #Read the files
-        dicts= []
+        #Set up reading the files
+        loaders= []
         if Z is None: #Z here is actually FeH, we correct this later
             ZS= _ZS
         else:
@@ -39,19 +54,24 @@ class AnIsochrone (Isochrone):
             else: signstr= 'm'
             if corrected: corrstr= 'corr'
             else: corrstr= 'marcs'
-            dicts.append(read_an_isochrone(os.path.join(_DATADIR,
-                                                        'an_isochrones',
-                                                        signstr+'%03i_' % (int(numpy.fabs(100.*Zm)))
-                                                        +corrstr+'.txt'),
-                                           filters=self._filters))
+            filename= os.path.join(_DATADIR,'an_isochrones',
+                                   signstr+'%03i_' % (int(numpy.fabs(100.*Zm)))
+                                   +corrstr+'.txt')
+            loaders.append(functools.partial(cached_read,
+                                             read_an_isochrone,[filename],
+                                             diskcache,filename,
+                                             filters=self._filters))
         self._ZS= numpy.array([FEH2Z(z,zsolar=_ANZSOLAR) for z in ZS])
-        self._dicts= dicts
-        #Gather ages
-        self._logages= numpy.array(sorted(list(set(self._dicts[0]['logage']))))
+        self._dicts= _IsochroneTables(loaders,lazy=lazy,
+                                      n_workers=n_workers,
+                                      executor=executor)
+        #Ages are gathered from the first metallicity when first needed
+        self._logages= None
+        if not lazy: self.logages()
         return None
         
     def __call__(self,logage,Z=None,feh=None,afe=None,maxm=None,
-                 asrecarray=False,stage=None):
+                 asrecarray=False,stage=None,copy=True):
         """
         NAME:
            __call__
@@ -66,6 +86,8 @@ class AnIsochrone (Isochrone):
            stage= if set, only show this evolutionary stage (NOT IMPLEMENTED FOR AN)
         KEYWORDS:
            asrecarray= if True, return recarray, otherwise dict
+           copy= (True) if False, return read-only views into the loaded
+                 tables rather than copies when possible (no maxm or stage)
         OUTPUT:
            isochrone
         HISTORY:
@@ -75,21 +97,8 @@ class AnIsochrone (Isochrone):
             raise NotImplementedError("'afe=' not implemented for Padova isochrones")
         if not feh is None:
             Z= 10.**(feh+math.log10(_ANZSOLAR))
-        indx= (self._ZS == Z)
-        ii= 0
-        while (ii < len(self._dicts) and not indx[ii]): ii+= 1
-        if ii == len(self._dicts):
-            raise IOError("No isochrone found that matches this metallicity")
-        thisDict= self._dicts[ii]
-        if maxm is None:
-            indx= (thisDict['logage'] == logage)
-        else:
-            indx= (thisDict['logage'] == logage)*(thisDict['Mass'] < maxm)
-        if numpy.sum(indx) == 0:
-            raise IOError("No isochrone found that matches this logage")
-        outDict= {}
-        for key in thisDict.keys():
-            outDict[key]= thisDict[key][indx]
+        outDict= self._extract(self._Zindex(Z),logage,maxm=maxm,require=True,
+                               copy=copy)
         if asrecarray:
             return dict2recarray(outDict)
         else:
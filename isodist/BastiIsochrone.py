@@ -1,10 +1,13 @@
 import os, os.path
 import glob
 import csv
+import functools
 import math
 import numpy
-from isodist.Isochrone import Isochrone, FEH2Z, Z2FEH, dict2recarray, logg
+from isodist.Isochrone import Isochrone, FEH2Z, Z2FEH, dict2recarray, logg, \
+    _IsochroneTables
 from isodist.PadovaIsochrone import _DATADIR
+from isodist._cache import cached_read
 _BASTIZSOLAR= 0.0198
 _ZS= [0.0001,0.0003,0.0006,0.001,0.002,0.004,0.008,0.01,0.0198,
       0.03,0.04]
@@ -41,7 +44,9 @@ post['uu_0bym1c1c1_0H_betaCa']= 'strm'
 strmfilters= ['u','u_0','b','y','m1','c1','c1_0','H_beta','Ca']
 class BastiIsochrone (Isochrone):
     """Class that represents a Basti isochrone"""
-    def __init__(self,Z=None,filters=None,eta=0.4,afe=False):
+    _masskey= 'M_ini'
+    def __init__(self,Z=None,filters=None,eta=0.4,afe=False,
+                 diskcache=False,lazy=False,n_workers=None,executor=None):
         """
         NAME:
            __init__
@@ -52,6 +57,15 @@ class BastiIsochrone (Isochrone):
            filters= list of filters to load (e.g., ['U','B','V','R','I','J','K','L'])
            eta= (0.4) mass-loss parameter
            afe= (False) if True, use alpha-enhanced isochrones
+           diskcache= (False) if True, cache the parsed tables in binary
+                      form ($ISODIST_CACHE or next to the data), if a
+                      string, cache them in this directory
+           lazy= (False) if True, only read the isochrones for a 
+                 metallicity when they are first needed
+           n_workers= (None) if set, read the files for the different
+                      metallicities in parallel with this many processes
+           executor= (None) if set, read the files in parallel with this
+                     executor or pool (e.g., a ThreadPoolExecutor)
         OUTPUT:
         HISTORY:
            2012-07-23 - Written - Bovy (IAS)
@@ -60,8 +74,8 @@ class BastiIsochrone (Isochrone):
             self._filters= ['U','B','V','R','I','J','H','K','L']
         else:
             self._filters= filters
-        #Read the files
-        dicts= []
+        #Set up reading the files
+        loaders= []
         if Z is None:
             ZS= _ZS
         else:
@@ -93,23 +107,31 @@ class BastiIsochrone (Isochrone):
                                                   +'y'+_YDICT['%.4f' % Zm]
                                                   +etastr+'*'
                                                   +'_'+post[postfilters]))
-            dicts.append(read_basti_isochrone(os.path.join(_DATADIR,
-                                                           subdir),
-                                              'wz'+_ZDICT['%.4f' % Zm]
-                                              +'y'+_YDICT['%.4f' % Zm]
-                                              +etastr,
-                                              '_'+post[postfilters],
-                                              ages=ages,
-                                              rawages=rawages,
-                                              filters=self._filters))
+            name1= 'wz'+_ZDICT['%.4f' % Zm]+'y'+_YDICT['%.4f' % Zm]+etastr
+            name2= '_'+post[postfilters]
+            loaders.append(functools.partial(cached_read,
+                                             read_basti_isochrone,
+                                             [os.path.join(_DATADIR,subdir,
+                                                           name1+r+name2)
+                                              for r in rawages],
+                                             diskcache,
+                                             os.path.join(_DATADIR,subdir),
+                                             name1,name2,
+                                             ages=ages,
+                                             rawages=rawages,
+                                             filters=self._filters))
+            if len(loaders) == 1: firstages= ages
         self._ZS= numpy.array(ZS)
-        self._dicts= dicts
-        #Gather ages
-        self._logages= numpy.array(sorted(list(set(self._dicts[0]['logage']))))
+        self._dicts= _IsochroneTables(loaders,lazy=lazy,
+                                      n_workers=n_workers,
+                                      executor=executor)
+        #Gather ages, these are known from the filenames
+        self._logages= numpy.array(sorted(list(set([9.+math.log10(a)
+                                                    for a in firstages]))))
         return None
         
     def __call__(self,logage,Z=None,feh=None,afe=None,maxm=None,
-                 asrecarray=False,stage=None):
+                 asrecarray=False,stage=None,copy=True):
         """
         NAME:
            __call__
@@ -123,6 +145,8 @@ class BastiIsochrone (Isochrone):
            stage= if set, only show this evolutionary stage (NOT IMPLEMENTED FOR BASTI)
         KEYWORDS:
            asrecarray= if True, return recarray
+           copy= (True) if False, return read-only views into the loaded
+                 tables rather than copies when possible (no maxm or stage)
         OUTPUT:
            isochrone
         HISTORY:
@@ -132,17 +156,8 @@ class BastiIsochrone (Isochrone):
             raise NotImplementedError("'afe=' not yet implemented for Basti isochrones")
         if not feh is None:
             Z= FEH2Z(feh)
-        indx= (self._ZS == Z)
-        ii= 0
-        while (not indx[ii]): ii+= 1
-        thisDict= self._dicts[ii]
-        if maxm is None:
-            indx= (thisDict['logage'] == logage)
-        else:
-            indx= (thisDict['logage'] == logage)*(thisDict['M_ini'] < maxm)
-        outDict= {}
-        for key in thisDict.keys():
-            outDict[key]= thisDict[key][indx]
+        outDict= self._extract(self._Zindex(Z),logage,maxm=maxm,
+                               copy=copy)
         if asrecarray:
             return dict2recarray(outDict)
         else:
@@ -32,10 +32,13 @@
 ###############################################################################
 import os, os.path
 import csv
+import functools
 import gzip
 import math
 import numpy
-from isodist.Isochrone import Isochrone, FEH2Z, Z2FEH, dict2recarray
+from isodist.Isochrone import Isochrone, FEH2Z, Z2FEH, dict2recarray, \
+    _IsochroneTables
+from isodist._cache import cached_read
 _FEHS= [-2.5,-2.,-1.5,-1.,-0.5,0.,0.2,0.3,0.5]
 _DATADIR= os.getenv('ISODIST_DATA')
 #Dictionary for last part of filename
@@ -46,7 +49,9 @@ if _DATADIR is None:
                            '../data')
 class DartmouthIsochrone (Isochrone):
     """Class that represents a Dartmouth isochrone"""
-    def __init__(self,feh=None,filters=None,afe=0.,onlyold=False):
+    _masskey= 'M'
+    def __init__(self,feh=None,filters=None,afe=0.,onlyold=False,
+                 diskcache=False,lazy=False,n_workers=None,executor=None):
         """
         NAME:
            __init__
@@ -57,6 +62,15 @@ class DartmouthIsochrone (Isochrone):
            filters= list of filters (optional)
            afe= [a/Fe] (default: 0.)
            onlyold= if True, only load age >= 1 Gyr
+           diskcache= (False) if True, cache the parsed tables in binary
+                      form ($ISODIST_CACHE or next to the data), if a
+                      string, cache them in this directory
+           lazy= (False) if True, only read the isochrones for a 
+                 metallicity when they are first needed
+           n_workers= (None) if set, read the files for the different
+                      metallicities in parallel with this many processes
+           executor= (None) if set, read the files in parallel with this
+                     executor or pool (e.g., a ThreadPoolExecutor)
         OUTPUT:
         HISTORY:
            2012-07-29 - Written - Bovy (IAS)
@@ -66,8 +80,8 @@ class DartmouthIsochrone (Isochrone):
             self._filters= ['U','B','V','R','I','J','H','Ks']
         else:
             self._filters= filters
-        #Read the files
-        dicts= []
+        #Set up reading the files
+        loaders= []
         if feh is None:
             FEHS= _FEHS
         else:
@@ -80,20 +94,29 @@ class DartmouthIsochrone (Isochrone):
             else: fehsignstr= 'm'
             if afe >= 0.: afesignstr= 'p'
             else: afesignstr= 'm'
-            dicts.append(read_dartmouth_isochrone(os.path.join(_DATADIR,
-                                                               'dartmouth-'+"".join(self._filters),
-                                                               'feh'+fehsignstr+'%02i' % (int(numpy.fabs(10.*fehm)))\
-                                                                   +'afe'+afesignstr+'%01i' % (int(numpy.fabs(10.*afe)))\
-                                                                   +'.'+post["".join(self._filters)]),
-                                                               filters=self._filters,onlyold=onlyold))
+            filename= os.path.join(_DATADIR,
+                                   'dartmouth-'+"".join(self._filters),
+                                   'feh'+fehsignstr+'%02i' % (int(numpy.fabs(10.*fehm)))\
+                                       +'afe'+afesignstr+'%01i' % (int(numpy.fabs(10.*afe)))\
+                                       +'.'+post["".join(self._filters)])
+            if onlyold: sources= [filename]
+            else: sources= [filename,filename+'_2']
+            loaders.append(functools.partial(cached_read,
+                                             read_dartmouth_isochrone,sources,
+                                             diskcache,filename,
+                                             filters=self._filters,
+                                             onlyold=onlyold))
         self._ZS= FEH2Z(numpy.array(FEHS))
-        self._dicts= dicts
-        #Gather ages
-        self._logages= numpy.array(sorted(list(set(self._dicts[0]['logage']))))
+        self._dicts= _IsochroneTables(loaders,lazy=lazy,
+                                      n_workers=n_workers,
+                                      executor=executor)
+        #Ages are gathered from the first metallicity when first needed
+        self._logages= None
+        if not lazy: self.logages()
         return None
 
     def __call__(self,logage,Z=None,feh=None,afe=None,maxm=None,
-                 asrecarray=False,stage=None):
+                 asrecarray=False,stage=None,copy=True):
         """
         NAME:
            __call__
@@ -107,6 +130,8 @@ class DartmouthIsochrone (Isochrone):
            stage= if set, only show this evolutionary stage (NOT IMPLEMENTED FOR DARTMOUTH)
         KEYWORDS:
            asrecarray= if True, return recarray
+           copy= (True) if False, return read-only views into the loaded
+                 tables rather than copies when possible (no maxm or stage)
         OUTPUT:
            isochrone
         HISTORY:
@@ -116,17 +141,8 @@ class DartmouthIsochrone (Isochrone):
             raise NotImplementedError("'afe=' not implemented for Padova isochrones")
         if not feh is None:
             Z= FEH2Z(feh)
-        indx= (self._ZS == Z)
-        ii= 0
-        while (not indx[ii]): ii+= 1
-        thisDict= self._dicts[ii]
-        if maxm is None:
-            indx= (thisDict['logage'] == logage)
-        else:
-            indx= (thisDict['logage'] == logage)*(thisDict['M'] < maxm)
-        outDict= {}
-        for key in thisDict.keys():
-            outDict[key]= thisDict[key][indx]
+        outDict= self._extract(self._Zindex(Z),logage,maxm=maxm,
+                               copy=copy)
         if asrecarray:
             return dict2recarray(outDict)
         else:
@@ -0,0 +1,255 @@
+###############################################################################
+#   DistPDF: distance PDF of a single object that can be updated cheaply
+#
+#   Quick start guide
+#   -----------------
+#
+#   - Initialization: >>>d= DistPDF({'J':12.,'Ks':11.5},{'J':100.,'Ks':100.},
+#                                   logg=4.,logg_ivar=25.,iso=p)
+#                     (same inputs as eval_distpdf)
+#
+#   - Evaluation: >>>d(ds)
+#                 returns the log distance PDF at distances ds
+#
+#   - Updates: >>>d.add_band('W1',11.,100.)
+#              >>>d.remove_band('J')
+#              >>>d.set_prior(ageprior='flat')
+#              >>>d.set_prior(imf='kroupa2003')
+#              only recompute the terms that change: the partial
+#              likelihoods of each band and constraint are kept for every
+#              isochrone point
+###############################################################################
+import numpy as nu
+from isodist._isodist import _load_grid, _parse_observations, \
+    _cell_logprior, _eval_mixture, _lognorm, _summarize, _logwidths
+class DistPDF:
+    """Class that holds the partial likelihoods of an object for every
+    isochrone point, such that its distance PDF can be re-evaluated
+    cheaply when bands, constraints, or priors change"""
+    def __init__(self,mdict=None,mivardict=None,logg=None,logg_ivar=None,
+                 teff=None,teff_ivar=None,logage=None,logage_ivar=None,
+                 Z=None,Z_ivar=None,feh=None,feh_ivar=None,
+                 afe=None,afe_ivar=None,
+                 padova=None,padova_type=None,iso=None,
+                 ageprior=None,logprior=None,imf=None):
+        """
+        NAME:
+           __init__
+        PURPOSE:
+           initialize
+        INPUT:
+           mdict= dictionary of apparent magnitudes (e.g., {'J':12.,'Ks':13.})
+           mivardict= dictionary of magnitude inverse variances (matched to
+                      mdict)
+           logg=, logg_ivar=, teff=, teff_ivar=, logage=, logage_ivar=, Z=,
+           Z_ivar=, feh=, feh_ivar=, afe=, afe_ivar=, padova=, padova_type=,
+           iso=, ageprior=, logprior=, imf= as for eval_distpdf
+        OUTPUT:
+        HISTORY:
+           2026-10-17 - Written - agent
+        """
+        self._grid= _load_grid(padova,padova_type,iso,imf)
+        self._maxpts= self._grid.logweights().shape[2]
+        self._pindx= nu.flatnonzero(self._grid.datamask().flatten())
+        self._set_weights()
+        self._obs= _parse_observations({},{},None,None,None,None,
+                                       logage,logage_ivar,Z,Z_ivar,
+                                       feh,feh_ivar,afe,afe_ivar,logprior)
+        self._ageprior= ageprior
+        self._cellprior= _cell_logprior(self._grid,self._obs,ageprior)\
+            .flatten()
+        #Partial likelihoods of the magnitudes: ivar, ivar (m-M), and
+        #ivar (m-M)^2 for each band
+        self._ivars, self._b, self._c= {}, {}, {}
+        self._A= 0.
+        self._B= nu.zeros(len(self._pindx))
+        self._C= nu.zeros(len(self._pindx))
+        if not mdict is None:
+            for band in mdict.keys():
+                self.add_band(band,mdict[band],mivardict[band])
+        self._terms= {}
+        self.set_logg(logg,logg_ivar)
+        self.set_teff(teff,teff_ivar)
+        return None
+
+    def __call__(self,ds,normalize=False,retZage=False,summary=False):
+        """
+        NAME:
+           __call__
+        PURPOSE:
+           evaluate the distance PDF
+        INPUT:
+           ds- list or ndarray of distance (or a single distance), in kpc
+           normalize= if True, normalize output PDF (default: False)
+           retZage= if True, also return the log of the PDF integrated over
+                    the distance grid for each isochrone, shape (nZ,nage)
+           summary= if True, return a record with the mode, mean, median,
+                    16th and 84th percentile of the distance PDF and its log
+                    evidence instead of the PDF
+        OUTPUT:
+           log of probability or summary record
+           (, log PDF for each isochrone if retZage)
+        HISTORY:
+           2026-10-17 - Written - agent
+        """
+        _ds= nu.atleast_1d(nu.array(ds,dtype='float'))
+        out, post= _eval_mixture(_ds,self._mixture(),
+                                 logwidth=_logwidths(_ds) if retZage
+                                 else None)
+        out= out[0]
+        if retZage:
+            cellout= post['Zage'][0].reshape((len(self._grid.Zs()),
+                                              len(self._grid.logages())))
+        if summary:
+            out= _summarize(_ds,out[nu.newaxis])[0]
+            lognorm= out['logevidence']
+        elif normalize and len(_ds) > 1:
+            lognorm= _lognorm(_ds,out)
+            out= out-lognorm
+        if normalize and retZage: cellout-= lognorm
+        if nu.ndim(ds) == 0 and not summary: out= out[0]
+        if retZage: return (out,cellout)
+        else: return out
+
+    def bands(self):
+        """Return the bands that are currently included"""
+        return list(self._ivars.keys())
+
+    def add_band(self,band,m,ivar):
+        """
+        NAME:
+           add_band
+        PURPOSE:
+           add (or replace) the magnitude in a band
+        INPUT:
+           band - name of the band (e.g., 'W1')
+           m - apparent magnitude
+           ivar - inverse variance of the magnitude
+        OUTPUT:
+           (none)
+        HISTORY:
+           2026-10-17 - Written - agent
+        """
+        if band in self._ivars: self.remove_band(band)
+        if not ivar > 0.: return None
+        dmag= m-self._grid[band].flatten()[self._pindx]
+        self._ivars[band]= float(ivar)
+        self._b[band]= ivar*dmag
+        self._c[band]= ivar*dmag**2.
+        self._A+= self._ivars[band]
+        self._B+= self._b[band]
+        self._C+= self._c[band]
+        return None
+
+    def remove_band(self,band):
+        """
+        NAME:
+           remove_band
+        PURPOSE:
+           remove the magnitude in a band
+        INPUT:
+           band - name of the band
+        OUTPUT:
+           (none)
+        HISTORY:
+           2026-10-17 - Written - agent
+        """
+        del self._ivars[band]
+        del self._b[band]
+        del self._c[band]
+        #Re-sum the remaining bands rather than subtracting, which would
+        #accumulate round-off in C-B^2/A
+        self._A= sum(self._ivars.values(),0.)
+        self._B= sum(self._b.values(),nu.zeros(len(self._pindx)))
+        self._C= sum(self._c.values(),nu.zeros(len(self._pindx)))
+        return None
+
+    def set_logg(self,logg,logg_ivar):
+        """Set (or remove, with logg=None) the logg constraint"""
+        self._set_term('logg',logg,logg_ivar)
+        return None
+
+    def set_teff(self,teff,teff_ivar):
+        """Set (or remove, with teff=None) the T_eff [K] constraint"""
+        self._set_term('Teff',teff,teff_ivar)
+        return None
+
+    def set_prior(self,**kwargs):
+        """
+        NAME:
+           set_prior
+        PURPOSE:
+           change the age and metallicity constraints and priors
+        INPUT:
+           any of logage=, logage_ivar=, Z=, Z_ivar=, feh=, feh_ivar=,
+           afe=, afe_ivar=, ageprior=, logprior=, imf= as for eval_distpdf
+           (set to None to remove)
+        OUTPUT:
+           (none; only the prior of each isochrone is re-computed)
+        HISTORY:
+           2026-10-17 - Written - agent
+        """
+        if 'ageprior' in kwargs: self._ageprior= kwargs.pop('ageprior')
+        if 'imf' in kwargs:
+            self._grid= self._grid.weighted(kwargs.pop('imf'))
+            self._set_weights()
+        for key in kwargs.keys():
+            if not key in self._obs or key in ['mags','ivars','nobj']:
+                raise TypeError("set_prior() got an unexpected keyword "
+                                +"argument '%s'" % key)
+        keys= ['logage','logage_ivar','Z','Z_ivar','feh','feh_ivar',
+               'afe','afe_ivar']
+        values= dict((key,kwargs.get(key,self._obs[key])) for key in keys)
+        if 'logprior' in kwargs: logprior= kwargs['logprior']
+        else: logprior= self._obs['logprior']
+        self._obs= _parse_observations({},{},None,None,None,None,
+                                       values['logage'],
+                                       values['logage_ivar'],
+                                       values['Z'],values['Z_ivar'],
+                                       values['feh'],values['feh_ivar'],
+                                       values['afe'],values['afe_ivar'],
+                                       logprior)
+        self._cellprior= _cell_logprior(self._grid,self._obs,self._ageprior)\
+            .flatten()
+        return None
+
+    def _set_weights(self):
+        logw= self._grid.logweights().flatten()
+        self._logw= logw[self._pindx]
+        #Points that only contribute their weight
+        self._cindx= nu.flatnonzero((True^self._grid.datamask().flatten())
+                                    *(logw > nu.finfo(nu.dtype(nu.float64))\
+                                          .min))
+        self._constw= logw[self._cindx]
+        return None
+
+    def _set_term(self,key,x,ivar):
+        if x is None: self._terms.pop(key,None)
+        else:
+            self._terms[key]= (x-self._grid[key].flatten()[self._pindx])**2.\
+                *ivar
+        return None
+
+    def _mixture(self):
+        """Mixture of Gaussians in distance modulus (see 
+        isodist._isodist._eval_mixture)"""
+        cell= self._pindx//self._maxpts
+        logamp= self._logw+self._cellprior[cell]
+        for key in self._terms: logamp= logamp-self._terms[key]
+        if self._A > 0.:
+            dm= self._B/self._A
+            logamp= logamp-(self._C-dm*self._B)
+        else:
+            dm= nu.zeros(len(self._pindx))
+        constcell= self._cindx//self._maxpts
+        constamp= self._constw+self._cellprior[constcell]
+        cellconst= nu.full(len(self._cellprior),-nu.inf)
+        nu.logaddexp.at(cellconst,constcell,constamp)
+        logconst= nu.logaddexp.reduce(cellconst) if len(cellconst) > 0 \
+            else -nu.inf
+        return {'logamp':logamp[nu.newaxis],'dm':dm[nu.newaxis],
+                'ivar':nu.atleast_1d(self._A),
+                'logconst':nu.atleast_1d(logconst),
+                'pindx':self._pindx,'cell':cell,'cindx':self._cindx,
+                'constamp':constamp[nu.newaxis],
+                'cellconst':cellconst[nu.newaxis]}
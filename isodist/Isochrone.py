@@ -1,5 +1,8 @@
 import re
 import math
+import multiprocessing
+import threading
+from collections import OrderedDict
 import numpy
 try:
     from galpy.util import bovy_plot
@@ -10,6 +13,7 @@ _LOGTESUN= numpy.log10(5777)
 _LOGGSUN= numpy.log10(27400.)
 class Isochrone:
     """Template for any Isochrone type class"""
+    _zsolar= None #solar Z for Z <-> [Fe/H] (None: default of FEH2Z)
     def __init__(self):
         """
         NAME:
@@ -68,6 +72,8 @@ class Isochrone:
         HISTORY:
            2011-04-27 - Written - Bovy (NYU)
         """
+        if self._logages is None:
+            self._logages= numpy.array(sorted(list(set(self._dicts[0]['logage']))))
         return self._logages
 
     def filters(self):
@@ -82,6 +88,261 @@ class Isochrone:
            2011-04-27 - Written - Bovy (NYU)
         """
         return self._filters
+    def grid(self,filters=None):
+        """
+        NAME:
+           grid
+        PURPOSE:
+           return all isochrones as an IsochroneGrid (padded arrays ready 
+           for evaluating likelihoods); the grid with all filters is cached
+        INPUT:
+           filters= list of filters to include (default: all)
+        OUTPUT:
+           IsochroneGrid instance
+        HISTORY:
+           2026-10-17 - Written - agent
+        """
+        from isodist.IsochroneGrid import IsochroneGrid
+        if not filters is None:
+            return IsochroneGrid(self,filters=filters)
+        if getattr(self,'_grid',None) is None:
+            self._grid= IsochroneGrid(self)
+        return self._grid
+
+    def batch(self,logage,Z=None,feh=None,afe=None,maxm=None,stage=None,
+              ignore_gaps=False):
+        """
+        NAME:
+           batch
+        PURPOSE:
+           get many isochrones from the library at once, concatenated into 
+           a single table
+        INPUT:
+           logage - log_10 age (array)
+           Z= or feh= metallicity (array, broadcast against logage)
+           afe= None (not supported for most isochrones)
+           maxm= maximum mass to consider (m_ini)
+           stage= if set, only return this evolutionary stage 
+                  (if this exists for this isochrone libary)
+           ignore_gaps= if True, return no rows for non-existant isochrones
+        OUTPUT:
+           (table,offsets): table is a structured array with all 
+           isochrones concatenated; the ii-th isochrone is 
+           table[offsets[ii]:offsets[ii+1]]
+        HISTORY:
+           2026-10-17 - Written - agent
+        """
+        if feh is None:
+            logage, Zs= numpy.broadcast_arrays(numpy.atleast_1d(logage),Z)
+            fehs= [None for ii in range(len(logage))]
+        else:
+            logage, fehs= numpy.broadcast_arrays(numpy.atleast_1d(logage),
+                                                 feh)
+            Zs= [None for ii in range(len(logage))]
+        isos= []
+        for ii in range(len(logage)):
+            try:
+                isos.append(self(logage[ii],Z=Zs[ii],feh=fehs[ii],afe=afe,
+                                 maxm=maxm,stage=stage,copy=False))
+            except IOError:
+                if ignore_gaps: isos.append(None)
+                else: raise
+        found= [iso for iso in isos if not iso is None]
+        if len(found) == 0: keys= list(self._dicts[0].keys())
+        else: keys= list(found[0].keys())
+        offsets= numpy.zeros(len(isos)+1,dtype=numpy.int64)
+        offsets[1:]= numpy.cumsum([0 if iso is None else len(iso[keys[0]])
+                                   for iso in isos])
+        out= numpy.empty(offsets[-1],dtype=[(key,numpy.float64) 
+                                            for key in keys])
+        if len(found) > 0:
+            for key in keys:
+                out[key]= numpy.concatenate([iso[key] for iso in found])
+        return (out,offsets)
+
+    def predict(self,logage,mass,Z=None,feh=None,keys=None,interp=False):
+        """
+        NAME:
+           predict
+        PURPOSE:
+           predict magnitudes, logg, Teff, ... for many stars at once by
+           interpolating in initial mass along the isochrones
+        INPUT:
+           logage - log_10 age (array)
+           mass - initial mass (array, broadcast against logage)
+           Z= or feh= metallicity (array, broadcast against logage)
+           keys= columns to predict (default: logg, Teff, and all filters)
+           interp= if True, also linearly interpolate between the 
+                   neighboring ages and metallicities of the grid; if 
+                   False, use the nearest isochrone (outside of the grid, 
+                   the isochrones at its edge are used in both cases)
+        OUTPUT:
+           dictionary of arrays; NaN for masses outside of the mass range of
+           the isochrone(s) (e.g., stars that have died) and for non-finite
+           logage or metallicity
+        HISTORY:
+           2026-10-17 - Written - agent
+        """
+        grid= self.grid()
+        if keys is None: keys= ['logg','Teff']+list(grid.filters())
+        if Z is None and feh is None:
+            raise ValueError("predict() requires the metallicity as Z= or feh=")
+        if Z is None: Z= FEH2Z(numpy.asarray(feh,dtype='float'),
+                               zsolar=grid.zsolar,parsec=grid.parsec)
+        logage, Z, mass= numpy.broadcast_arrays(
+            numpy.asarray(logage,dtype='float'),
+            numpy.asarray(Z,dtype='float'),
+            numpy.asarray(mass,dtype='float'))
+        shape= logage.shape
+        logage, Z, mass= logage.flatten(), Z.flatten(), mass.flatten()
+        alo, ahi, afrac= _bracket(grid.logages(),logage,interp)
+        zlo, zhi, zfrac= _bracket(grid.Zs(),Z,interp)
+        nage= len(grid.logages())
+        good= numpy.isfinite(logage)*numpy.isfinite(Z)
+        #Interpolate along the (up to) four surrounding isochrones and
+        #combine them; a corner with zero weight does not contribute its NaN
+        out= dict((key,numpy.where(good,0.,numpy.nan)) for key in keys)
+        for zindx, zweight in [(zlo,1.-zfrac),(zhi,zfrac)]:
+            for aindx, aweight in [(alo,1.-afrac),(ahi,afrac)]:
+                weight= numpy.where(good,zweight*aweight,0.)
+                use= numpy.flatnonzero(weight > 0.)
+                cols= grid.interpolate(zindx[use]*nage+aindx[use],mass[use],
+                                       keys)
+                for key in keys:
+                    out[key][use]+= weight[use]*cols[key]
+        for key in keys:
+            out[key]= out[key].reshape(shape)
+        return out
+
+    def enable_cache(self,maxsize=128,maxbytes=None):
+        """
+        NAME:
+           enable_cache
+        PURPOSE:
+           memoize the isochrones returned by __call__ in a least-recently-
+           used cache; while the cache is enabled, __call__ returns 
+           read-only arrays that are shared between calls
+        INPUT:
+           maxsize= (128) maximum number of cached isochrones 
+                    (None: no limit; 0: disable the cache)
+           maxbytes= (None) maximum number of bytes held by the cache
+                     (views into the loaded tables do not count)
+        OUTPUT:
+           (none)
+        HISTORY:
+           2026-10-17 - Written - agent
+        """
+        if maxsize == 0:
+            self._lru= None
+        else:
+            self._lru= _LRUCache(maxsize=maxsize,maxbytes=maxbytes)
+        return None
+
+    def clear_cache(self):
+        """
+        NAME:
+           clear_cache
+        PURPOSE:
+           empty the cache of isochrones set up by enable_cache
+        INPUT:
+        OUTPUT:
+           (none)
+        HISTORY:
+           2026-10-17 - Written - agent
+        """
+        if not getattr(self,'_lru',None) is None:
+            self._lru.clear()
+        return None
+
+    def cache_info(self):
+        """
+        NAME:
+           cache_info
+        PURPOSE:
+           return statistics of the cache of isochrones set up by 
+           enable_cache
+        INPUT:
+        OUTPUT:
+           dictionary with hits, misses, size, bytes, maxsize, and maxbytes
+           (None if the cache is not enabled)
+        HISTORY:
+           2026-10-17 - Written - agent
+        """
+        if getattr(self,'_lru',None) is None: return None
+        return self._lru.info()
+
+    def _Zindex(self,Z):
+        """Index of metallicity Z in the list of loaded metallicities"""
+        if getattr(self,'_Zindices',None) is None:
+            self._Zindices= {}
+            for ii in range(len(self._ZS)-1,-1,-1): #first match wins
+                self._Zindices[self._ZS[ii]]= ii
+        if numpy.size(Z) == 1: #numpy scalars and 0-d arrays
+            Z= float(numpy.asarray(Z).reshape(-1)[0])
+        try:
+            return self._Zindices[Z]
+        except (KeyError,TypeError):
+            raise IOError("No isochrone found that matches this metallicity")
+
+    def _extract(self,ii,logage,maxm=None,stage=None,require=False,
+                 copy=True):
+        """
+        NAME:
+           _extract
+        PURPOSE:
+           extract a single isochrone from the table of one metallicity
+        INPUT:
+           ii - index of the metallicity
+           logage - log_10 age (needs to match the table exactly)
+           maxm= maximum mass to consider (in the mass column _masskey)
+           stage= if set, only return this evolutionary stage
+           require= (False) if True, raise IOError if nothing is found
+           copy= (True) if False, return read-only views into the table
+                 when no copy is necessary
+        OUTPUT:
+           isochrone (dictionary)
+        HISTORY:
+           2026-10-17 - Written - agent
+        """
+        lru= getattr(self,'_lru',None)
+        if lru is None:
+            return self._select(ii,logage,maxm=maxm,stage=stage,
+                                require=require,copy=copy)
+        key= (ii,logage,maxm,stage)
+        outDict= lru.get(key)
+        if outDict is None:
+            outDict= self._select(ii,logage,maxm=maxm,stage=stage,
+                                  require=require,copy=False)
+            for arr in outDict.values(): arr.flags.writeable= False
+            lru.put(key,outDict,
+                    sum([a.nbytes for a in outDict.values() if a.base is None]))
+        return dict(outDict)
+
+    def _select(self,ii,logage,maxm=None,stage=None,require=False,copy=True):
+        """Select the rows of a single isochrone, see _extract"""
+        thisDict= self._dicts[ii]
+        indx= self._dicts.rows(ii,logage)
+        if not maxm is None or not stage is None:
+            if isinstance(indx,slice):
+                indx= numpy.arange(indx.start,indx.stop)
+            else:
+                indx= numpy.flatnonzero(indx)
+            if not maxm is None:
+                indx= indx[thisDict[self._masskey][indx] < maxm]
+            if not stage is None:
+                indx= indx[thisDict['stage'][indx] == stage]
+        outDict= {}
+        if not copy and isinstance(indx,slice):
+            for key in thisDict.keys():
+                outDict[key]= thisDict[key][indx].view(numpy.ndarray)
+                outDict[key].flags.writeable= False
+        else:
+            for key in thisDict.keys():
+                outDict[key]= numpy.array(thisDict[key][indx])
+        if require and len(outDict['logage']) == 0:
+            raise IOError("No isochrone found that matches this logage")
+        return outDict
+
 ###################################PLOTTING####################################
     def plot(self,logage,*args,**kwargs):
         """
@@ -187,6 +448,20 @@ class Isochrone:
         #plot
         return bovy_plot.bovy_plot(x,y,*args,**kwargs)
 
+def _bracket(nodes,x,interp):
+    """Indices of the grid nodes below and above x and the fractional 
+    position of x between them (rounded to 0 or 1 if not interp)"""
+    order= numpy.argsort(nodes)
+    nodes= numpy.asarray(nodes)[order]
+    if len(nodes) < 2:
+        zero= numpy.zeros(len(x),dtype='int')
+        return (order[zero],order[zero],numpy.zeros(len(x)))
+    lo= numpy.clip(numpy.searchsorted(nodes,x,side='right')-1,
+                   0,len(nodes)-2)
+    frac= numpy.clip((x-nodes[lo])/(nodes[lo+1]-nodes[lo]),0.,1.)
+    if not interp: frac= numpy.where(frac >= 0.5,1.,0.)
+    return (order[lo],order[lo+1],frac)
+
 def Z2FEH(z,zsolar=None,parsec=False):
     """Convert Z to FeH assuming zsolar"""
     if parsec:
@@ -225,10 +500,177 @@ def logg(logL,logTe,mass):
     return numpy.log10(mass)-2.*logR+_LOGGSUN
 
 def dict2recarray(dict):
-    nEntries= len(dict.keys())
-    nOut= len(dict[dict.keys()[0]])
-    out= numpy.zeros(nOut,dtype={'names':dict.keys(),
+    keys= list(dict.keys())
+    nEntries= len(keys)
+    nOut= len(dict[keys[0]])
+    out= numpy.zeros(nOut,dtype={'names':keys,
                                  'formats':[numpy.float64 for ii in range(nEntries)]})
     for ii in range(nEntries):
-        out[dict.keys()[ii]]= dict[dict.keys()[ii]]
+        out[keys[ii]]= dict[keys[ii]]
     return out.view(numpy.recarray)
+
+class _IsochroneTables:
+    """List of per-metallicity tables that are read when first accessed"""
+    def __init__(self,loaders,lazy=False,n_workers=None,executor=None):
+        """
+        NAME:
+           __init__
+        PURPOSE:
+           initialize
+        INPUT:
+           loaders - list of functions (without arguments) that each return
+                     the table for one metallicity (need to be picklable
+                     to be run in a process pool)
+           lazy= (False) if True, only read a table when it is first accessed
+           n_workers= (None) if set, read the tables in parallel using a 
+                      pool of this many processes
+           executor= (None) if set, read the tables in parallel using 
+                     this executor or pool (anything with an ordered map)
+        OUTPUT:
+        HISTORY:
+           2026-10-17 - Written - agent
+        """
+        self._loaders= loaders
+        self._tables= [None for ii in range(len(loaders))]
+        self._indices= [None for ii in range(len(loaders))]
+        if not lazy:
+            self.load(n_workers=n_workers,executor=executor)
+        return None
+
+    def __len__(self):
+        return len(self._tables)
+
+    def __getitem__(self,ii):
+        if self._tables[ii] is None:
+            self[ii]= self._loaders[ii]()
+        return self._tables[ii]
+
+    def __setitem__(self,ii,table):
+        self._tables[ii]= table
+        self._indices[ii]= _age_index(table['logage'])
+        return None
+
+    def __iter__(self):
+        for ii in range(len(self._tables)):
+            yield self[ii]
+
+    def load(self,n_workers=None,executor=None):
+        """
+        NAME:
+           load
+        PURPOSE:
+           read all tables that have not been read yet
+        INPUT:
+           n_workers= (None) if set, read the tables in parallel using a 
+                      pool of this many processes
+           executor= (None) if set, read the tables in parallel using 
+                     this executor or pool (anything with an ordered map)
+        OUTPUT:
+           (none; tables are stored in the order of the loaders)
+        HISTORY:
+           2026-10-17 - Written - agent
+        """
+        todo= [ii for ii in range(len(self._tables))
+               if self._tables[ii] is None]
+        loaders= [self._loaders[ii] for ii in todo]
+        if not executor is None:
+            tables= list(executor.map(_call,loaders))
+        elif not n_workers is None and n_workers > 1 and len(todo) > 1:
+            pool= multiprocessing.Pool(min(n_workers,len(todo)))
+            try:
+                tables= pool.map(_call,loaders)
+            finally:
+                pool.close()
+                pool.join()
+        else:
+            tables= [_call(loader) for loader in loaders]
+        for ii, table in zip(todo,tables):
+            self[ii]= table
+        return None
+
+    def rows(self,ii,logage):
+        """
+        NAME:
+           rows
+        PURPOSE:
+           find the rows of a table that belong to a given age
+        INPUT:
+           ii - index of the table
+           logage - log_10 age (needs to match the table exactly)
+        OUTPUT:
+           slice of the rows (boolean index if the table is not
+           grouped by age)
+        HISTORY:
+           2026-10-17 - Written - agent
+        """
+        table= self[ii]
+        if self._indices[ii] is None:
+            return table['logage'] == logage
+        start, end= self._indices[ii].get(logage,(0,0))
+        return slice(start,end)
+
+    def loaded(self):
+        """Return a list of booleans indicating which tables have been read"""
+        return [not t is None for t in self._tables]
+
+class _LRUCache:
+    """Thread-safe least-recently-used cache with a size and byte budget"""
+    def __init__(self,maxsize=128,maxbytes=None):
+        self._maxsize= maxsize
+        self._maxbytes= maxbytes
+        self._entries= OrderedDict()
+        self._lock= threading.Lock()
+        self.clear()
+        return None
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._bytes= 0
+            self._hits= 0
+            self._misses= 0
+        return None
+
+    def get(self,key):
+        with self._lock:
+            try:
+                value, nbytes= self._entries.pop(key)
+            except KeyError:
+                self._misses+= 1
+                return None
+            self._entries[key]= (value,nbytes) #most recently used is last
+            self._hits+= 1
+            return value
+
+    def put(self,key,value,nbytes):
+        with self._lock:
+            if key in self._entries:
+                self._bytes-= self._entries.pop(key)[1]
+            self._entries[key]= (value,nbytes)
+            self._bytes+= nbytes
+            while len(self._entries) > 0 \
+                    and ((not self._maxsize is None 
+                          and len(self._entries) > self._maxsize)
+                         or (not self._maxbytes is None
+                             and self._bytes > self._maxbytes)):
+                self._bytes-= self._entries.popitem(last=False)[1][1]
+        return None
+
+    def info(self):
+        with self._lock:
+            return {'hits':self._hits,'misses':self._misses,
+                    'size':len(self._entries),'bytes':self._bytes,
+                    'maxsize':self._maxsize,'maxbytes':self._maxbytes}
+
+def _call(func):
+    return func()
+
+def _age_index(logage):
+    """Map each age to its (start,end) rows, None if not grouped by age"""
+    if len(logage) == 0: return {}
+    edges= numpy.flatnonzero(logage[1:] != logage[:-1])+1
+    starts= numpy.append(0,edges)
+    ends= numpy.append(edges,len(logage))
+    ages= logage[starts].tolist()
+    if len(set(ages)) < len(ages): return None
+    return dict(zip(ages,zip(starts.tolist(),ends.tolist())))
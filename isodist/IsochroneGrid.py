@@ -0,0 +1,331 @@
+###############################################################################
+#   IsochroneGrid: all isochrones of an Isochrone instance in padded arrays
+#
+#   Quick start guide
+#   -----------------
+#
+#   - Initialization: >>>p= PadovaIsochrone()
+#                     >>>g= IsochroneGrid(p)
+#                     or
+#                     >>>g= p.grid() (cached on the Isochrone instance)
+#
+#   - Columns: >>>g['J']
+#              returns an array of shape (nZ,nage,max_points) with the J
+#              magnitudes of all isochrones, padded with NaN
+#
+#   - Likelihood: g.logweights() are the log mass weights of each point,
+#                 g.datamask() indicates the points that enter the
+#                 likelihood with their magnitudes, logg, and Teff
+#
+#   - Pruning: g.kdtree(colors=[('J','Ks')],logg=True) returns a KD-tree
+#              over the colors, logg, and Teff of these points (cached)
+#
+#   - IMF: g.weighted('kroupa2003') returns the grid with the points weighted
+#          by the number of stars of this IMF instead of by their mass
+#          spacing (cached)
+###############################################################################
+import numpy
+from scipy import spatial
+from isodist import imf as imfs
+class IsochroneGrid:
+    """Class that holds all isochrones of an Isochrone instance in padded
+    (nZ,nage,max_points) arrays"""
+    def __init__(self,iso,filters=None):
+        """
+        NAME:
+           __init__
+        PURPOSE:
+           initialize
+        INPUT:
+           iso - Isochrone instance (PadovaIsochrone, BastiIsochrone, ...)
+           filters= list of filters to include (default: all)
+        OUTPUT:
+        HISTORY:
+           2026-10-17 - Written - agent
+        """
+        self._ZS= numpy.array(iso.Zs())
+        self._logages= numpy.array(iso.logages())
+        if filters is None:
+            filters= iso.filters()
+        self._filters= list(filters)
+        self._masskey= iso._masskey
+        self.parsec= getattr(iso,'parsec',False)
+        self.zsolar= getattr(iso,'_zsolar',None)
+        nZ, nage= len(self._ZS), len(self._logages)
+        #Gather all isochrones
+        isos= []
+        for zz in range(nZ):
+            for aa in range(nage):
+                try:
+                    isos.append(iso(self._logages[aa],Z=self._ZS[zz],
+                                    copy=False))
+                except IOError: #Missing isochrone
+                    isos.append(None)
+        self._npts= numpy.array([0 if thisiso is None
+                                 else len(thisiso[self._masskey])
+                                 for thisiso in isos]).reshape((nZ,nage))
+        maxpts= max(1,numpy.amax(self._npts))
+        #Store the columns
+        keys= [self._masskey,'logTe','logg']+self._filters
+        found= [thisiso for thisiso in isos if not thisiso is None]
+        for key in ['logL','M_act','int_IMF','stage']:
+            if len(found) > 0 and key in found[0]: keys.append(key)
+        self._cols= {}
+        for key in keys:
+            self._cols[key]= numpy.full((nZ*nage,maxpts),numpy.nan)
+            for ii, thisiso in enumerate(isos):
+                if thisiso is None: continue
+                self._cols[key][ii,:len(thisiso[key])]= thisiso[key]
+            self._cols[key]= self._cols[key].reshape((nZ,nage,maxpts))
+        self._cols['Teff']= 10**self._cols['logTe']
+        self._valid= numpy.arange(maxpts) < self._npts[:,:,numpy.newaxis]
+        #Likelihood weights: points are weighted by their mass spacing to
+        #the next point (the last point is not included) and normalized by
+        #the maximum mass; the first point only carries the normalization
+        mass= self._cols[self._masskey]
+        dm= numpy.full(mass.shape,numpy.nan)
+        dm[:,:,:-1]= mass[:,:,1:]-mass[:,:,:-1]
+        self._data= self._inner()*(dm > 0.)
+        self._logw= self._logweights(mass)
+        self._trees= {}
+        self._imfgrids= {None:self}
+        self._pools= {} #'pool': the pool of processes of this family of grids
+        return None
+
+    def __getstate__(self):
+        """The pool of processes that evaluate slabs of the grid (see 
+        eval_distpdf's n_workers=) is not pickled"""
+        state= self.__dict__.copy()
+        state['_pools']= {}
+        return state
+
+    def __getitem__(self,key):
+        return self._cols[key]
+
+    def slab(self,zs):
+        """
+        NAME:
+           slab
+        PURPOSE:
+           return the part of the grid for a range of metallicities
+        INPUT:
+           zs - slice of metallicity indices
+        OUTPUT:
+           IsochroneGrid instance whose arrays are views into this grid's
+        HISTORY:
+           2026-10-17 - Written - agent
+        """
+        out= IsochroneGrid.__new__(IsochroneGrid)
+        out._ZS= self._ZS[zs]
+        out._logages= self._logages
+        out._filters= self._filters
+        out._masskey= self._masskey
+        out.parsec= self.parsec
+        out.zsolar= self.zsolar
+        out._npts= self._npts[zs]
+        out._cols= dict((key,self._cols[key][zs]) for key in self._cols)
+        out._valid= self._valid[zs]
+        out._data= self._data[zs]
+        out._logw= self._logw[zs]
+        out._trees= {}
+        out._imfgrids= {None:out}
+        out._pools= {}
+        return out
+
+    def weighted(self,imf):
+        """
+        NAME:
+           weighted
+        PURPOSE:
+           return the grid with the points weighted by the number of stars 
+           of an IMF between their mass and that of the next point, 
+           normalized by the number of stars below the maximum mass (cached,
+           such that switching between IMFs is free after the first time)
+        INPUT:
+           imf - None: weight by the mass spacing (flat IMF; this grid)
+                 name of an IMF in isodist.imf (e.g., 'kroupa2003')
+                 function that returns dN/dM (e.g., isodist.imf.kroupa2003 
+                 or a PiecewisePowerLaw instance; see isodist.imf.cumulative)
+                 'int_IMF': use the integrated IMF of the isochrone files
+        OUTPUT:
+           IsochroneGrid instance that shares everything but its log weights
+           with this grid
+        HISTORY:
+           2026-10-17 - Written - agent
+        """
+        if imf in self._imfgrids: return self._imfgrids[imf]
+        if isinstance(imf,str) and imf == 'int_IMF':
+            if not 'int_IMF' in self._cols:
+                raise ValueError("Isochrones do not have an int_IMF column")
+            cumul= self._cols['int_IMF']
+        else:
+            with numpy.errstate(invalid='ignore'):
+                cumul= imfs.cumulative(imfs._lookup(imf),
+                                       self._cols[self._masskey])
+        out= self.slab(slice(None))
+        out._logw= self._logweights(cumul)
+        out._trees= self._trees #same points, so same KD-trees
+        out._imfgrids= self._imfgrids
+        out._pools= self._pools #at most one pool for all weightings
+        self._imfgrids[imf]= out
+        return out
+
+    def close(self):
+        """
+        NAME:
+           close
+        PURPOSE:
+           stop the pool of processes that evaluates slabs of this grid or 
+           of any of its weighted() versions (see eval_distpdf's 
+           n_workers=); a later call with n_workers= starts a new one
+        INPUT:
+           (none)
+        OUTPUT:
+           (none)
+        HISTORY:
+           2026-10-17 - Written - agent
+        """
+        pool= self._pools.pop('pool',None)
+        if not pool is None: pool.close()
+        return None
+
+    def keys(self):
+        """Return the available columns"""
+        return list(self._cols.keys())
+
+    def Zs(self):
+        """Return the metallicities of the grid"""
+        return self._ZS
+
+    def logages(self):
+        """Return the log_10 ages of the grid"""
+        return self._logages
+
+    def filters(self):
+        """Return the filters in the grid"""
+        return self._filters
+
+    def npts(self):
+        """Return the number of points of each isochrone, shape (nZ,nage)"""
+        return self._npts
+
+    def validmask(self):
+        """Return the mask of the real (non-padding) points"""
+        return self._valid
+
+    def logweights(self):
+        """Return the log mass weight of each point (-inf for points that
+        do not contribute to the likelihood)"""
+        return self._logw
+
+    def datamask(self):
+        """Return the mask of points whose magnitudes, logg, and Teff enter
+        the likelihood (the other points only contribute their weight)"""
+        return self._data
+
+    def interpolate(self,cells,mass,keys):
+        """
+        NAME:
+           interpolate
+        PURPOSE:
+           linearly interpolate columns in initial mass along isochrones, for
+           many (isochrone,mass) pairs at once
+        INPUT:
+           cells - flat indices iZ*nage+iage of the isochrones (array)
+           mass - initial masses (array matched to cells)
+           keys - list of columns to interpolate (e.g., ['logg','J'])
+        OUTPUT:
+           dictionary of arrays; NaN for masses outside of the mass range of 
+           their isochrone (e.g., stars that have died)
+        HISTORY:
+           2026-10-17 - Written - agent
+        """
+        maxpts= self._valid.shape[2]
+        masses= self._cols[self._masskey].reshape((-1,maxpts))
+        cells= numpy.asarray(cells)
+        mass= numpy.asarray(mass,dtype='float')
+        last= numpy.maximum(self._npts.flatten()[cells]-1,0)
+        #Bisect all isochrones at once for masses[lo] <= mass < masses[hi]
+        lo= numpy.zeros(cells.shape,dtype='int')
+        hi= last
+        for ii in range(int(numpy.ceil(numpy.log2(max(maxpts,2)))+1)):
+            mid= (lo+hi)//2
+            right= masses[cells,mid] <= mass
+            lo= numpy.where(right,mid,lo)
+            hi= numpy.where(right,hi,mid)
+        mlo, mhi= masses[cells,lo], masses[cells,hi]
+        with numpy.errstate(invalid='ignore',divide='ignore'):
+            frac= numpy.where(mhi > mlo,(mass-mlo)/(mhi-mlo),0.)
+        inside= (last > 0)*(mass >= masses[cells,0])\
+            *(mass <= masses[cells,last])
+        out= {}
+        for key in keys:
+            col= self._cols[key].reshape((-1,maxpts))
+            clo= col[cells,lo]
+            out[key]= numpy.where(inside,clo+frac*(col[cells,hi]-clo),
+                                  numpy.nan)
+        return out
+
+    def _inner(self):
+        """Mask of the points between the first and the last point"""
+        index= numpy.arange(self._valid.shape[2])
+        return (index > 0)*(index < self._npts[:,:,numpy.newaxis]-1)
+
+    def _logweights(self,cumul):
+        """Log weights of the points given the (cumulative) number of stars
+        below each point's mass"""
+        nZ, nage, maxpts= cumul.shape
+        dn= numpy.full(cumul.shape,numpy.nan)
+        dn[:,:,:-1]= cumul[:,:,1:]-cumul[:,:,:-1]
+        with numpy.errstate(divide='ignore',invalid='ignore'):
+            lognorm= -numpy.log(cumul.reshape((nZ*nage,maxpts))\
+                                    [numpy.arange(nZ*nage),
+                                     numpy.maximum(self._npts.flatten()-1,0)])\
+                                    .reshape((nZ,nage,1))
+            good= self._data*(dn > 0.)
+        logw= numpy.full(cumul.shape,-numpy.inf)
+        logw[:,:,0]= lognorm[:,:,0]
+        logw[self._inner()]= numpy.finfo(numpy.dtype(numpy.float64)).min
+        logw[good]= (lognorm+numpy.log(numpy.where(good,dn,1.)))[good]
+        logw[self._npts < 2,0]= -numpy.inf
+        return logw
+
+    def kdtree(self,colors=[],logg=False,teff=False):
+        """
+        NAME:
+           kdtree
+        PURPOSE:
+           return a KD-tree over distance-independent quantities of the 
+           points that enter the likelihood with their data (cached)
+        INPUT:
+           colors= list of colors, given as (band1,band2) for band1-band2
+           logg= if True, include logg
+           teff= if True, include Teff
+        OUTPUT:
+           (tree,scale,index,features): tree is a scipy.spatial.cKDTree of 
+           features/scale (scale is the standard deviation of each 
+           feature), index the flat indices of its points in the grid, and
+           features the unscaled (npoints,nfeatures) features; points with 
+           non-finite features are not in the tree and are returned as 
+           index[len(tree.data):]
+        HISTORY:
+           2026-10-17 - Written - agent
+        """
+        key= (tuple([tuple(c) for c in colors]),bool(logg),bool(teff))
+        if key in self._trees: return self._trees[key]
+        index= numpy.flatnonzero(self._data)
+        features= [self._cols[b1].flatten()[index]
+                   -self._cols[b2].flatten()[index] for b1,b2 in colors]
+        if logg: features.append(self._cols['logg'].flatten()[index])
+        if teff: features.append(self._cols['Teff'].flatten()[index])
+        features= numpy.array(features,ndmin=2).reshape((len(features),
+                                                         len(index))).T
+        finite= numpy.all(numpy.isfinite(features),axis=1)
+        index= numpy.concatenate((index[finite],index[True^finite]))
+        features= numpy.concatenate((features[finite],features[True^finite]))
+        scale= numpy.std(features[:numpy.sum(finite)],axis=0) \
+            if numpy.sum(finite) > 0 else numpy.ones(features.shape[1])
+        scale[(scale == 0.)+(True^numpy.isfinite(scale))]= 1.
+        tree= spatial.cKDTree(features[:numpy.sum(finite)]/scale)
+        self._trees[key]= (tree,scale,index,features)
+        return self._trees[key]
@@ -32,12 +32,14 @@
 ###############################################################################
 import sys
 import os, os.path
-import csv
 import copy
+import functools
 import gzip
 import math
 import numpy as nu
-from isodist.Isochrone import Isochrone, FEH2Z, Z2FEH, dict2recarray
+from isodist.Isochrone import Isochrone, FEH2Z, Z2FEH, dict2recarray, \
+    _IsochroneTables
+from isodist._cache import cached_read
 _ZS= [0.002,0.004,0.006,0.008,0.01,0.012,0.014,0.016,0.018,0.02,0.022,
       0.024,0.026,0.028,0.03]
 _DATADIR= os.getenv('ISODIST_DATA')
@@ -48,8 +50,10 @@ if sys.version_info[0] < 3:
     FileNotFoundError= IOError
 class PadovaIsochrone (Isochrone):
     """Class that represents a Padova isochrone"""
+    _masskey= 'M_ini'
     def __init__(self,type='2mass-spitzer-wise',Z=None,filters=None,
-                 parsec=False,eta=None):
+                 parsec=False,eta=None,diskcache=False,lazy=False,
+                 n_workers=None,executor=None):
         """
         NAME:
            __init__
@@ -62,6 +66,15 @@ class PadovaIsochrone (Isochrone):
            parsec= if True, use new PARSEC isochrones
            eta= Reimers mass loss efficiency parameter 
                 (default: 0.4 for Padova, 0.2 for PARSEC)
+           diskcache= (False) if True, cache the parsed tables in binary
+                      form ($ISODIST_CACHE or next to the data), if a
+                      string, cache them in this directory
+           lazy= (False) if True, only read the isochrones for a 
+                 metallicity when they are first needed
+           n_workers= (None) if set, read the files for the different
+                      metallicities in parallel with this many processes
+           executor= (None) if set, read the files in parallel with this
+                     executor or pool (e.g., a ThreadPoolExecutor)
         OUTPUT:
         HISTORY:
            2011-04-27 - Written - Bovy (NYU)
@@ -77,8 +90,8 @@ class PadovaIsochrone (Isochrone):
             filters= ['U','B','V','R','I','J','H','K']
         elif type.lower() == 'gaiadr2-tycho-2mass':
             filters= ['G','G_BP','G_RP','B_T','V_T','J','H','Ks']
-        #Read the files
-        dicts= []
+        #Set up reading the files
+        loaders= []
         if Z is None:
             ZS= _ZS
         else:
@@ -98,29 +111,28 @@ class PadovaIsochrone (Isochrone):
             else:
                 raise NotImplementedError('Non-default eta not implemented yet for Padova isochrones')
         for Zm in ZS:
-            try:
-                dicts.append(read_padova_isochrone(os.path.join(_DATADIR,
-                                                                basename,
-                                                                basename+'-Z-%5.3f.dat.gz' % Zm),
-                                                   filters=filters,
-                                                   parsec=parsec))
-            except FileNotFoundError: #4?
-                dicts.append(read_padova_isochrone(os.path.join(_DATADIR,
-                                                                basename,
-                                                                basename+'-Z-%5.4f.dat.gz' % Zm),
-                                                   filters=filters,
-                                                   parsec=parsec))
-                
+            filename= os.path.join(_DATADIR,basename,
+                                   basename+'-Z-%5.3f.dat.gz' % Zm)
+            if not os.path.exists(filename): #4?
+                filename= os.path.join(_DATADIR,basename,
+                                       basename+'-Z-%5.4f.dat.gz' % Zm)
+            loaders.append(functools.partial(cached_read,
+                                             read_padova_isochrone,[filename],
+                                             diskcache,filename,
+                                             filters=filters,parsec=parsec))
         self._ZS= nu.array(ZS)
-        self._dicts= dicts
+        self._dicts= _IsochroneTables(loaders,lazy=lazy,
+                                      n_workers=n_workers,
+                                      executor=executor)
         self._filters= filters
-        #Gather ages
-        self._logages= nu.array(sorted(list(set(self._dicts[0]['logage']))))
+        #Ages are gathered from the first metallicity when first needed
+        self._logages= None
+        if not lazy: self.logages()
         return None
 
     def __call__(self,logage,Z=None,feh=None,afe=None,maxm=None,
                  asrecarray=False,
-                 stage=None):
+                 stage=None,copy=True):
         """
         NAME:
            __call__
@@ -134,6 +146,8 @@ class PadovaIsochrone (Isochrone):
            stage= if set, only show this evolutionary stage
         KEYWORDS:
            asrecarray= if True, return recarray
+           copy= (True) if False, return read-only views into the loaded
+                 tables rather than copies when possible (no maxm or stage)
         OUTPUT:
            isochrone
         HISTORY:
@@ -143,21 +157,10 @@ class PadovaIsochrone (Isochrone):
             raise NotImplementedError("'afe=' not implemented for Padova isochrones")
         if not feh is None:
             Z= FEH2Z(feh,parsec=self.parsec)
-        indx= (self._ZS == Z)
-        ii= 0
-        while (not indx[ii]): ii+= 1
-        thisDict= self._dicts[ii]
         #round logage
         logage= round(100.*logage)/100.
-        if maxm is None:
-            indx= (thisDict['logage'] == logage)
-        else:
-            indx= (thisDict['logage'] == logage)*(thisDict['M_ini'] < maxm)
-        if not stage is None:
-            indx *= (thisDict['stage'] == stage)
-        outDict= {}
-        for key in thisDict.keys():
-            outDict[key]= thisDict[key][indx]
+        outDict= self._extract(self._Zindex(Z),logage,maxm=maxm,stage=stage,
+                               copy=copy)
         if asrecarray:
             return dict2recarray(outDict)
         else:
@@ -185,7 +188,7 @@ class PadovaIsochrone (Isochrone):
         except ValueError: # Probably that len(self._ZS) != len(iso._ZS)
             raise RuntimeError("Can only merge PadovaIsochrones with the same metallicities")
         try:
-            if nu.amax(nu.fabs(self._logages-iso._logages)) > 1e-10:
+            if nu.amax(nu.fabs(self.logages()-iso.logages())) > 1e-10:
                 raise RuntimeError("Can only merge PadovaIsochrones with the same logages")
         except ValueError: # Probably that len(self._logages) != len(iso._logages)
                 raise RuntimeError("Can only merge PadovaIsochrones with the same logages")
@@ -197,6 +200,10 @@ class PadovaIsochrone (Isochrone):
             newdict= copy.deepcopy(iso._dicts[ii])
             newdict.update(self._dicts[ii]) # overwrites common
             self._dicts[ii]= newdict
+        self.clear_cache()
+        if not getattr(self,'_grid',None) is None:
+            self._grid.close()
+        self._grid= None
         return None
 
 def read_padova_isochrone(name,filters=None,parsec=False):
@@ -216,81 +223,37 @@ def read_padova_isochrone(name,filters=None,parsec=False):
     HISTORY:
        2011-04-26 - Written - Bovy (NYU)
     """
-    dialect= csv.excel
-    dialect.skipinitialspace=True
     if name[-2:] == 'gz':
         file= gzip.open(name,'rt')
     else:
         file= open(name,'rt')
-    reader= csv.reader(file,delimiter='\t',
-                       dialect=dialect)
+    #Parse the whole file at once into a (ncols,nrows) table
+    try:
+        table= nu.loadtxt(file,comments='#',ndmin=2)
+    finally:
+        file.close()
+    table= nu.ascontiguousarray(table.T)
     nfilters= len(filters)
-    ncols= nfilters+13
-    logage=[]
-    M_ini= []
-    M_act= []
-    logL= []
-    logTe= []
-    logg= []
-    mbol= []
-    if not parsec:
-        CO= []
-        M_hec= []
-        period= []
-        pmode= []
-        logMdot= []
-    int_IMF= []
-    mags= []
-    if parsec: stage= []
-    for row in reader:
-        try:
-            if row[0][0] == '#':
-                continue
-        except IndexError:
-            pass
-        logage.append(float(row[1+parsec])) #parsec has Z as a column
-        M_ini.append(float(row[2+parsec]))
-        M_act.append(float(row[3+parsec]))
-        logL.append(float(row[4+parsec]))
-        logTe.append(float(row[5+parsec]))
-        logg.append(float(row[6+parsec]))
-        mbol.append(float(row[7+parsec]))
-        thismags= []
-        for ii in range(nfilters):
-            thismags.append(float(row[8+parsec+ii]))
-        mags.append(thismags)
-        if not parsec:
-            CO.append(float(row[8+nfilters]))
-            M_hec.append(float(row[9+nfilters]))
-            period.append(float(row[10+nfilters]))
-            pmode.append(float(row[11+nfilters]))
-            logMdot.append(float(row[12+nfilters]))
-        int_IMF.append(float(row[13-4*parsec+nfilters])) #4 bc of extra Z
-        if parsec:
-            stage.append(float(row[14-4*parsec+nfilters]))
     #Load everything into a dictionary
     outDict= {}
-    outDict['logage']= nu.array(logage)
-    outDict['M_ini']= nu.array(M_ini)
-    outDict['M_act']= nu.array(M_act)
-    outDict['logL']= nu.array(logL)
-    outDict['logTe']= nu.array(logTe)
-    outDict['logg']= nu.array(logg)
-    outDict['mbol']= nu.array(mbol)
+    outDict['logage']= table[1+parsec] #parsec has Z as a column
+    outDict['M_ini']= table[2+parsec]
+    outDict['M_act']= table[3+parsec]
+    outDict['logL']= table[4+parsec]
+    outDict['logTe']= table[5+parsec]
+    outDict['logg']= table[6+parsec]
+    outDict['mbol']= table[7+parsec]
     if not parsec:
-        outDict['CO']= nu.array(CO)
-        outDict['M_hec']= nu.array(M_hec)
-        outDict['period']= nu.array(period)
-        outDict['pmode']= nu.array(pmode)
-        outDict['logMdot']= nu.array(logMdot)
-    outDict['int_IMF']= nu.array(int_IMF)
+        outDict['CO']= table[8+nfilters]
+        outDict['M_hec']= table[9+nfilters]
+        outDict['period']= table[10+nfilters]
+        outDict['pmode']= table[11+nfilters]
+        outDict['logMdot']= table[12+nfilters]
+    outDict['int_IMF']= table[13-4*parsec+nfilters] #4 bc of extra Z
     if parsec:
-        outDict['stage']= nu.array(stage)
+        outDict['stage']= table[14-4*parsec+nfilters]
     for ii in range(nfilters):
-        thismag= []
-        for jj in range(len(mags)):
-            thismag.append(mags[jj][ii])
-        outDict[filters[ii]]= nu.array(thismag)
+        outDict[filters[ii]]= table[8+parsec+ii]
     return outDict
 
 def padovaTypes():
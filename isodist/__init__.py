@@ -4,3 +4,6 @@ from isodist.PadovaIsochrone import PadovaIsochrone, padovaTypes
 from isodist.AnIsochrone import AnIsochrone
 from isodist.BastiIsochrone import BastiIsochrone
 from isodist.DartmouthIsochrone import DartmouthIsochrone
+from isodist.IsochroneGrid import IsochroneGrid
+from isodist.DistPDF import DistPDF
+from isodist.synthesis import synthesize
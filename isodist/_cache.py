@@ -0,0 +1,148 @@
+###############################################################################
+#   isodist._cache: persistent binary cache of parsed isochrone tables
+#
+#   Parsed tables (dictionaries of equal-length float arrays) are stored as
+#   a single (ncolumns,nrows) .npy file plus a small .json header that holds
+#   the column names and the fingerprint (size, mtime, sha1) of the source
+#   files; later loads memory-map the .npy file. An entry is re-generated
+#   when its source files change (a changed size/mtime only triggers a
+#   re-parse when the sha1 of the source files also changed)
+#
+#   The cache directory is $ISODIST_CACHE if set, otherwise a .isodist-cache
+#   directory next to the data files
+###############################################################################
+import os, os.path
+import json
+import hashlib
+import warnings
+import numpy
+_CACHEVERSION= 1
+_CACHEDIR= os.getenv('ISODIST_CACHE')
+_CACHESUBDIR= '.isodist-cache'
+_replace= getattr(os,'replace',os.rename)
+def cached_read(readfunc,sources,cache,*args,**kwargs):
+    """
+    NAME:
+       cached_read
+    PURPOSE:
+       call a function that reads an isochrone table, going through the
+       disk cache
+    INPUT:
+       readfunc - function that returns a dictionary of equal-length arrays
+       sources - list of the files read by readfunc (used to invalidate)
+       cache - if False, simply call readfunc; if True, use the default
+               cache directory; if a string, use this directory
+       +args and kwargs for readfunc
+    OUTPUT:
+       dictionary with the table (read-only, memory-mapped arrays if loaded
+       from the cache)
+    HISTORY:
+       2026-10-17 - Written - agent
+    """
+    if not cache:
+        return readfunc(*args,**kwargs)
+    sources= [os.path.abspath(s) for s in sources]
+    if isinstance(cache,str):
+        cachedir= cache
+    elif not _CACHEDIR is None:
+        cachedir= _CACHEDIR
+    else:
+        cachedir= os.path.join(os.path.dirname(sources[0]),_CACHESUBDIR)
+    key= _cache_key(readfunc,sources,args,kwargs)
+    headername= os.path.join(cachedir,key+'.json')
+    tablename= os.path.join(cachedir,key+'.npy')
+    out= _load(headername,tablename,sources)
+    if not out is None:
+        return out
+    out= readfunc(*args,**kwargs)
+    try:
+        _save(headername,tablename,sources,out)
+    except (IOError,OSError) as e:
+        warnings.warn("Could not write isochrone cache entry %s (%s)" \
+                          % (tablename,e))
+    return out
+
+def _cache_key(readfunc,sources,args,kwargs):
+    """Hash of everything that determines the parsed table"""
+    keystr= repr((_CACHEVERSION,readfunc.__module__,readfunc.__name__,
+                  sources,[_listify(a) for a in args],
+                  [(k,_listify(v)) for k,v in sorted(kwargs.items())]))
+    return readfunc.__name__+'-'+hashlib.sha1(keystr.encode()).hexdigest()
+
+def _listify(arg):
+    """Make sure that arrays are not abbreviated in the key"""
+    if isinstance(arg,numpy.ndarray): return arg.tolist()
+    else: return arg
+
+def _sha1(name):
+    sha= hashlib.sha1()
+    with open(name,'rb') as file:
+        for block in iter(lambda: file.read(1048576),b''):
+            sha.update(block)
+    return sha.hexdigest()
+
+def _fingerprint(name,sha1=True):
+    stat= os.stat(name)
+    return [name,stat.st_size,stat.st_mtime,_sha1(name) if sha1 else None]
+
+def _load(headername,tablename,sources):
+    """Return the cached table or None if it is missing or stale"""
+    try:
+        with open(headername,'r') as file:
+            header= json.load(file)
+    except (IOError,OSError,ValueError):
+        return None
+    if len(header['sources']) != len(sources): return None
+    touched= False
+    for source, cached in zip(sources,header['sources']):
+        if cached[0] != source: return None
+        try:
+            current= _fingerprint(source,sha1=False)
+        except OSError:
+            return None
+        if current[1:3] == cached[1:3]: continue
+        if current[1] != cached[1] or _sha1(source) != cached[3]:
+            return None
+        #Same contents, only touched: remember the new mtime
+        cached[2]= current[2]
+        touched= True
+    try:
+        table= numpy.load(tablename,mmap_mode='r')
+    except ValueError: #empty tables cannot be memory-mapped
+        table= numpy.load(tablename)
+    except (IOError,OSError):
+        return None
+    if table.shape[0] != len(header['keys']): return None
+    if touched:
+        try:
+            _write_atomic(headername,
+                          lambda file: json.dump(header,file),mode='w')
+        except (IOError,OSError):
+            pass
+    return dict((key,table[ii]) for ii,key in enumerate(header['keys']))
+
+def _save(headername,tablename,sources,table):
+    keys= list(table.keys())
+    nrows= set(len(table[key]) for key in keys)
+    if len(nrows) > 1: return None #can only cache rectangular tables
+    if not os.path.exists(os.path.dirname(tablename)):
+        os.makedirs(os.path.dirname(tablename))
+    #The header is written last, such that it marks a complete entry
+    _write_atomic(tablename,
+                  lambda file: numpy.save(file,
+                                          numpy.array([table[key]
+                                                       for key in keys],
+                                                      dtype=numpy.float64,
+                                                      ndmin=2)),
+                  mode='wb')
+    header= {'keys':keys,'sources':[_fingerprint(s) for s in sources]}
+    _write_atomic(headername,lambda file: json.dump(header,file),mode='w')
+    return None
+
+def _write_atomic(name,write,mode='w'):
+    """Write to a temporary file and move it into place"""
+    tmpname= name+'.%i.tmp' % os.getpid()
+    with open(tmpname,mode) as file:
+        write(file)
+    _replace(tmpname,name)
+    return None
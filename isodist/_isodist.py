@@ -1,3 +1,4 @@
+import multiprocessing
 import numpy as nu
 import scipy
 _SCIPY_VERSION= [int(v.split('rc')[0])
@@ -8,23 +9,34 @@ elif _SCIPY_VERSION[0] < 1 and _SCIPY_VERSION[1] < 19:
     from scipy.misc import logsumexp
 else:
     from scipy.special import logsumexp
-from isodist.Isochrone import Isochrone
+from isodist.Isochrone import Isochrone, Z2FEH
 from isodist.PadovaIsochrone import PadovaIsochrone
+from isodist.IsochroneGrid import IsochroneGrid
 _LOGTOLN= 1./nu.log10(nu.exp(1.))
+_BLOCKSIZE= 2**22 #number of (object,distance,point) elements done at once
+_MAXREFINE= 30 #maximum number of refinements of adaptive distance grids
+_SUMMARYDTYPE= [('mode','f8'),('mean','f8'),('median','f8'),('p16','f8'),
+                ('p84','f8'),('logevidence','f8')]
+_OBSKEYS= ['logg','logg_ivar','teff','teff_ivar','logage','logage_ivar',
+           'Z','Z_ivar','feh','feh_ivar','afe','afe_ivar']
 def eval_distpdf(ds,mdict=None,mivardict=None,logg=None,logg_ivar=None,
                  teff=None,teff_ivar=None,logage=None,logage_ivar=None,
                  Z=None,Z_ivar=None,feh=None,feh_ivar=None,
                  afe=None,afe_ivar=None,
-                 padova=None,padova_type=None,
+                 padova=None,padova_type=None,iso=None,
                  normalize=False,
-                 ageprior=None):
+                 ageprior=None,logprior=None,imf=None,
+                 engine='grid',prune=None,retbound=False,
+                 adaptive=None,ninit=21,retZage=False,posteriors=None,
+                 summary=False,n_workers=None):
     """
     NAME:
        eval_distpdf
     PURPOSE:
        evaluate the distance PDF for an object
     INPUT:
-       ds- list or ndarray of distance (or a single distance), in kpc
+       ds- list or ndarray of distance (or a single distance), in kpc;
+           (dmin,dmax) range if adaptive is set
        mdict= dictionary of apparent magnitudes (e.g., {'J':12.,'Ks':13.})
        mivardict= dictionary of magnitude inverse variances (matched to mdict)
        logg= observed logg
@@ -35,86 +47,963 @@ def eval_distpdf(ds,mdict=None,mivardict=None,logg=None,logg_ivar=None,
        logage_ivar= inverse variance of log_10 age measurement
        Z= observed metallicity
        Z_ivar= inverse variance of Z measurement
-       feh= observed metallicity (alternative to Z)
+       feh= observed metallicity (alternative to Z; converted using the 
+            solar metallicity of the isochrones, see Z2FEH)
        feh_ivar= inverse variance of FeH measurement
-       afe= observed [\alpha/Fe]
-       afe_ivar= [\alpha/Fe] inverse variance
+       afe= observed [\alpha/Fe]; used with feh= (required) to get the 
+            scaled-solar metallicity of the isochrones (Salaris et al. 1993)
+       afe_ivar= [\alpha/Fe] inverse variance (None: exact)
        padova= if True, use Padova isochrones, 
                if set to a PadovaIsochrone objects, use this
        padova_type= type of PadovaIsochrone to use (e.g., 2mass-spitzer-wise)
-       normalize= if True, normalize output PDF (default: False)
+       iso= Isochrone or IsochroneGrid instance to use (instead of padova=);
+            the grid of an Isochrone instance is cached on that instance
+       normalize= if True, normalize output PDF (default: False); 
+                  non-uniform distance grids are normalized using the 
+                  width of the cell around each distance
        ageprior= - None: flat in log age
                  - flat: flat in age
+       logprior= log prior for each isochrone, shape (nZ,nage), added to 
+                 the age prior
+       imf= (None) weight the isochrone points by the number of stars of 
+            this IMF between their mass and that of the next point instead 
+            of by their mass spacing: name of an IMF in isodist.imf (e.g., 
+            'kroupa2003'), dN/dM function, or 'int_IMF' for the integrated 
+            IMF of the isochrone files (see IsochroneGrid.weighted; the 
+            weights are computed once per grid and IMF)
+       engine= - 'grid': evaluate every isochrone point at every distance
+               - 'gaussian': combine the magnitudes of each isochrone point
+                 into a single Gaussian in distance modulus first
+       prune= if set to k, only evaluate the isochrone points within 
+              k sigma of the observed colors, logg, and Teff (found using 
+              the KD-tree of the isochrone grid, see IsochroneGrid.kdtree); 
+              these points are evaluated with the 'gaussian' engine
+       retbound= if True and prune is set, also return the log of an upper
+                 bound on the contribution of the skipped points to the 
+                 (log) PDF at any distance
+       adaptive= if set to a fraction, start from a uniform grid of ninit 
+                 distances between ds=(dmin,dmax) and repeatedly halve all
+                 intervals that hold more than this fraction of the total 
+                 probability
+       ninit= (21) number of distances in the initial adaptive grid
+       retZage= if True, also return the log of the PDF integrated over the
+                distance grid for each isochrone, shape (nZ,nage)
+       posteriors= if True or set to an array of bin edges in initial mass,
+                   also return a dictionary with the log of the PDF 
+                   integrated over the distance grid and marginalized over 
+                   everything else as a function of 'logage' (nage,), 'Z' 
+                   (nZ,), and initial 'mass' (nbins,) (in bins 'massbins'; 
+                   True: 20 logarithmic bins covering the grid), computed 
+                   in the same pass as the PDF
+       summary= if True, return a record with the mode, mean, median, 16th 
+                and 84th percentile of the distance PDF and its log 
+                evidence (log of its integral) instead of the PDF
+       n_workers= (None) if set, evaluate slabs of metallicities in 
+                  parallel using a pool of this many processes (which 
+                  share the isochrone grid when the platform can fork); 
+                  the pool is started on first use and kept on the grid,
+                  such that later calls with the same n_workers and imf 
+                  reuse its processes; a different n_workers or imf 
+                  replaces it; it is stopped by the grid's close() (or 
+                  when the Python session ends)
     OUTPUT:
-       log of probability
+       log of probability or summary record (, log bound if retbound)
+       (, log PDF for each isochrone if retZage)(, dictionary of 
+       posteriors if posteriors is set); 
+       (distances,log of probability(, ...)) if adaptive is set
     HISTORY:
        2011-04-28 - Written - Bovy (NYU)
     """
     #load isochrones
-    if not padova is None and isinstance(padova,PadovaIsochrone):
-        iso= padova
-    elif not padova is None and isinstance(padova,bool) and padova:
-        iso= PadovaIsochrone(type=padova_type)
-    #Parse metallicity info
-    if not feh is None: raise NotImplementedError("'feh' not yet implemented")
+    grid= _load_grid(padova,padova_type,iso,imf)
     #set up output
-    if isinstance(ds,(list,nu.ndarray)):
+    if not adaptive is None:
+        scalarOut= False
+    elif isinstance(ds,(list,nu.ndarray)):
         scalarOut= False
         if isinstance(ds,list):
             _ds= nu.array(ds)
         else: _ds= ds
     elif isinstance(ds,float):
         scalarOut= True
-        _ds= [ds]
-    #Pre-calculate all absolute magnitudes
-    absmagdict= {}
-    for key in mdict.keys():
-        absmagdict[key]= -_distmodulus(_ds)+mdict[key]        
-    #loop through isochrones
-    ZS= iso.Zs()
-    logages= iso.logages()
-    allout= nu.zeros((len(_ds),len(ZS),len(logages)))
-    for zz in range(len(ZS)):
-        for aa in range(len(logages)):
-            thisiso= iso(logages[aa],Z=ZS[zz])
-            dmpm= nu.roll(thisiso['M_ini'],-1)-thisiso['M_ini']
-            loglike= nu.zeros((len(_ds),len(thisiso['M_ini'])-1))
-            loglike-= nu.log(thisiso['M_ini'][-1])
-            for ii in range(1,len(thisiso['M_ini'])-1):
-                if dmpm[ii] > 0.: 
-                    loglike[:,ii]+= nu.log(dmpm[ii])
-                else: 
-                    loglike[:,ii]= nu.finfo(nu.dtype(nu.float64)).min
-                    continue #no use in continuing here
-                if not teff is None:
-                    loglike[:,ii]-= (teff-10**thisiso['logTe'][ii])**2.*teff_ivar
-                if not logg is None:
-                    loglike[:,ii]-= (logg-thisiso['logg'][ii])**2.*logg_ivar
-                for key in mdict.keys():
-                    #print absmagdict[key][2], thisiso[key][ii]
-                    loglike[:,ii]-= (absmagdict[key]-thisiso[key][ii])**2.\
-                        *mivardict[key]
-            #marginalize over mass
-            for jj in range(len(_ds)):
-                allout[jj,zz,aa]= logsumexp(loglike[jj,:])
-            #add age constraint and prior
-            if not logage is None:
-                allout[:,zz,aa]+= -(logage-logages[aa])**2.*logage_ivar
-            if not ageprior is None:
-                if isinstance(ageprior,str) and ageprior.lower() == 'flat':
-                    allout[:,zz,aa]+= logages[aa]*_LOGTOLN
-        #add Z constraint and prior
-        if not Z is None:
-            allout[:,zz,:]+= -(Z-ZS[zz])**2.*Z_ivar
-    #prepare final output
-    out= nu.zeros(len(_ds))
-    for jj in range(len(_ds)):
-        out[jj]= logsumexp(allout[jj,:,:])
+        _ds= nu.array([ds])
+    #evaluate as a single-star batch
+    obs= _parse_observations(mdict,mivardict,logg,logg_ivar,teff,teff_ivar,
+                             logage,logage_ivar,Z,Z_ivar,feh,feh_ivar,
+                             afe,afe_ivar,logprior)
+    if posteriors is None or posteriors is False: massbins= None
+    elif posteriors is True: massbins= _default_massbins(grid)
+    else: massbins= nu.array(posteriors,dtype='float')
+    pool= _SlabPool.open(grid,n_workers)
+    if adaptive is None:
+        out, post, logbound= _eval_distances(grid,_ds,obs,ageprior,
+                                             engine,prune,
+                                             logwidth=_logwidths(_ds)
+                                             if retZage 
+                                             or not massbins is None
+                                             else None,
+                                             massbins=massbins,
+                                             pool=pool)
+    else:
+        _ds, out, logbound= \
+            _refine_distances(lambda d: \
+                                  _eval_distances(grid,d,obs,ageprior,
+                                                  engine,prune,pool=pool),
+                              ds[0],ds[1],adaptive,ninit)
+        if retZage or not massbins is None: #one more pass
+            post= _eval_distances(grid,_ds,obs,ageprior,engine,prune,
+                                  logwidth=_logwidths(_ds),
+                                  massbins=massbins,pool=pool)[1]
+    out, logbound= out[0], logbound[0]
+    if retZage or not massbins is None:
+        post= _posteriors(grid,post,massbins)
+        post= dict((key,post[key][0]) for key in post)
+        if not massbins is None: post['massbins']= massbins
+    if summary:
+        out= _summarize(_ds,out[nu.newaxis])[0]
+        lognorm= out['logevidence']
+    elif normalize and not scalarOut:
+        lognorm= _lognorm(_ds,out)
+        out= out-lognorm
     if normalize and not scalarOut:
-        out-= logsumexp(out)+nu.log(ds[1]-ds[0])
+        logbound-= lognorm
+        if retZage or not massbins is None:
+            for key in post:
+                if key != 'massbins': post[key]= post[key]-lognorm
     #return
-    if scalarOut: return out[0]
+    if scalarOut and not summary: out= out[0]
+    return _output(_ds if not adaptive is None else None,out,
+                   logbound if retbound else None,
+                   post['Zage'] if retZage else None,
+                   post if not massbins is None else None)
+
+def eval_distpdf_batch(ds,mdict=None,mivardict=None,logg=None,logg_ivar=None,
+                       teff=None,teff_ivar=None,logage=None,logage_ivar=None,
+                       Z=None,Z_ivar=None,feh=None,feh_ivar=None,
+                       afe=None,afe_ivar=None,
+                       padova=None,padova_type=None,iso=None,
+                       normalize=False,
+                       ageprior=None,logprior=None,imf=None,
+                       engine='grid',prune=None,retbound=False,
+                       retZage=False,posteriors=None,summary=False,
+                       chunksize=100,n_workers=None):
+    """
+    NAME:
+       eval_distpdf_batch
+    PURPOSE:
+       evaluate the distance PDF for many objects at once
+    INPUT:
+       ds- list or ndarray of distances, in kpc
+       mdict= dictionary of arrays of apparent magnitudes (e.g., 
+              {'J':[12.,11.],'Ks':[13.,12.5]}); missing magnitudes should
+              have zero inverse variance
+       mivardict= dictionary of magnitude inverse variances (matched to 
+                  mdict; arrays or scalars)
+       logg= observed logg (array)
+       logg_ivar= inverse variance of logg measurement
+       teff= observed T_eff [K] (array)
+       teff_ivar= inverse variance of T_eff measurement
+       logage= observed log_10 age [Gyr] (array)
+       logage_ivar= inverse variance of log_10 age measurement
+       Z= observed metallicity (array)
+       Z_ivar= inverse variance of Z measurement
+       feh= observed metallicity (alternative to Z; converted using the 
+            solar metallicity of the isochrones, see Z2FEH)
+       feh_ivar= inverse variance of FeH measurement
+       afe= observed [\alpha/Fe]; used with feh= (required) to get the 
+            scaled-solar metallicity of the isochrones (Salaris et al. 1993)
+       afe_ivar= [\alpha/Fe] inverse variance (None: exact)
+       padova= if True, use Padova isochrones, 
+               if set to a PadovaIsochrone objects, use this
+       padova_type= type of PadovaIsochrone to use (e.g., 2mass-spitzer-wise)
+       iso= Isochrone or IsochroneGrid instance to use (instead of padova=);
+            the grid of an Isochrone instance is cached on that instance
+       normalize= if True, normalize output PDFs (default: False); 
+                  non-uniform distance grids are normalized using the 
+                  width of the cell around each distance
+       ageprior= - None: flat in log age
+                 - flat: flat in age
+       logprior= log prior for each isochrone, shape (nZ,nage) or 
+                 (nobject,nZ,nage), added to the age prior
+       imf= (None) IMF to weight the isochrone points with (see 
+            eval_distpdf)
+       engine= - 'grid': evaluate every isochrone point at every distance
+               - 'gaussian': combine the magnitudes of each isochrone point
+                 into a single Gaussian in distance modulus first
+       prune= if set to k, only evaluate the isochrone points within 
+              k sigma of the observed colors, logg, and Teff (found using 
+              the KD-tree of the isochrone grid, see IsochroneGrid.kdtree); 
+              these points are evaluated with the 'gaussian' engine
+       retbound= if True and prune is set, also return the log of an upper
+                 bound on the contribution of the skipped points to the 
+                 (log) PDF at any distance
+       retZage= if True, also return the log of the PDF integrated over the
+                distance grid for each isochrone, shape (nobject,nZ,nage)
+       posteriors= if True or set to an array of bin edges in initial mass,
+                   also return a dictionary with the log of the PDF 
+                   integrated over the distance grid and marginalized over 
+                   everything else as a function of 'logage' 
+                   (nobject,nage), 'Z' (nobject,nZ), and initial 'mass' 
+                   (nobject,nbins) (in bins 'massbins'; True: 20 
+                   logarithmic bins covering the grid), computed in the 
+                   same pass as the PDF
+       summary= if True, return a record array (nobject,) with the mode, 
+                mean, median, 16th and 84th percentile of the distance PDF
+                and its log evidence (log of its integral) instead of the 
+                PDFs; these are computed for each chunk of objects, such 
+                that the PDFs of all objects are never held in memory
+       chunksize= (100) number of objects that are evaluated together 
+                  (memory scales as chunksize x len(ds) x points/isochrone)
+       n_workers= (None) if set, evaluate slabs of metallicities in 
+                  parallel using a pool of this many processes (which 
+                  share the isochrone grid when the platform can fork); 
+                  the pool is started on first use and kept on the grid,
+                  such that later calls with the same n_workers and imf 
+                  reuse its processes; a different n_workers or imf 
+                  replaces it; it is stopped by the grid's close() (or 
+                  when the Python session ends)
+    OUTPUT:
+       log of probability, shape (nobject,len(ds)), or summary records 
+       (, log bound for each object if retbound)(, log PDF for each 
+       isochrone if retZage)(, dictionary of posteriors if posteriors is
+       set)
+    HISTORY:
+       2026-10-17 - Written - agent
+    """
+    #load isochrones
+    grid= _load_grid(padova,padova_type,iso,imf)
+    _ds= nu.atleast_1d(nu.array(ds,dtype='float'))
+    obs= _parse_observations(mdict,mivardict,logg,logg_ivar,teff,teff_ivar,
+                             logage,logage_ivar,Z,Z_ivar,feh,feh_ivar,
+                             afe,afe_ivar,logprior)
+    if summary: out= nu.empty(obs['nobj'],dtype=_SUMMARYDTYPE)
+    else: out= nu.empty((obs['nobj'],len(_ds)))
+    logbound= nu.full(obs['nobj'],-nu.inf)
+    if posteriors is None or posteriors is False: massbins= None
+    elif posteriors is True: massbins= _default_massbins(grid)
+    else: massbins= nu.array(posteriors,dtype='float')
+    if retZage or not massbins is None:
+        logwidth= _logwidths(_ds)
+        post= None
+    else: logwidth= None
+    if obs['nobj'] == 0: #no objects: empty outputs
+        if not logwidth is None:
+            post= _posteriors(grid,
+                              {'Zage':nu.empty((0,len(grid.Zs()),
+                                                len(grid.logages()))),
+                               'mass':nu.empty((0,0 if massbins is None
+                                                else len(massbins)-1))},
+                              massbins)
+            if not massbins is None: post['massbins']= massbins
+        return _output(None,out,logbound if retbound else None,
+                       post['Zage'] if retZage else None,
+                       post if not massbins is None else None)
+    pool= _SlabPool.open(grid,n_workers)
+    for start in range(0,obs['nobj'],chunksize):
+        chunk= slice(start,min(start+chunksize,obs['nobj']))
+        thisout, thispost, logbound[chunk]= \
+            _eval_distances(grid,_ds,_chunk_observations(obs,chunk),
+                            ageprior,engine,prune,logwidth=logwidth,
+                            massbins=massbins,pool=pool)
+        if not logwidth is None:
+            thispost= _posteriors(grid,thispost,massbins)
+            if post is None:
+                post= dict((key,nu.empty((obs['nobj'],)
+                                         +thispost[key].shape[1:]))
+                           for key in thispost)
+        if summary:
+            out[chunk]= _summarize(_ds,thisout)
+            lognorm= out['logevidence'][chunk]
+        else:
+            if normalize:
+                lognorm= _lognorm(_ds,thisout)
+                thisout-= lognorm[:,nu.newaxis]
+            out[chunk]= thisout
+        if normalize:
+            logbound[chunk]-= lognorm
+        if not logwidth is None:
+            for key in thispost:
+                post[key][chunk]= thispost[key]
+                if normalize:
+                    post[key][chunk]-= \
+                        lognorm.reshape((-1,)+(1,)*(post[key].ndim-1))
+    if not massbins is None: post['massbins']= massbins
+    return _output(None,out,logbound if retbound else None,
+                   post['Zage'] if retZage else None,
+                   post if not massbins is None else None)
+
+def _eval_distances(grid,_ds,obs,ageprior,engine,prune,logwidth=None,
+                    massbins=None,pool=None):
+    """Log PDF (nobj,len(_ds)), dictionary of integrated PDFs if logwidth 
+    is given (else None; see _eval_chunk), and log bound on the skipped 
+    points (nobj,); pool= _SlabPool to use"""
+    if not pool is None:
+        return pool.eval(_ds,obs,ageprior,engine,prune,logwidth,massbins)
+    elif prune is None:
+        return _ENGINES[engine](grid,_ds,obs,ageprior,logwidth=logwidth,
+                                massbins=massbins)\
+            +(nu.full(obs['nobj'],-nu.inf),)
+    else:
+        return _eval_pruned(grid,_ds,obs,ageprior,prune,logwidth=logwidth,
+                            massbins=massbins)
+
+def _summarize(_ds,out):
+    """Summary statistics (_SUMMARYDTYPE records, shape (nobj,)) of log PDFs
+    out (nobj,len(_ds)), using the width of the cell around each distance"""
+    summ= nu.empty(out.shape[0],dtype=_SUMMARYDTYPE)
+    if len(_ds) > 1: logevidence= _lognorm(_ds,out)
+    else: logevidence= out[:,0]
+    summ['logevidence']= logevidence
+    summ['mode']= _ds[nu.argmax(out,axis=1)]
+    with nu.errstate(invalid='ignore'):
+        mass= nu.exp(out-logevidence[:,nu.newaxis]+_logwidths(_ds))
+        summ['mean']= nu.sum(mass*_ds,axis=1)
+        #CDF at the distances, counting half of their own cell
+        cdf= nu.cumsum(mass,axis=1)-0.5*mass
+        for name, q in [('median',0.5),('p16',0.16),('p84',0.84)]:
+            summ[name]= _percentile(_ds,cdf,q)
+    return summ
+
+def _percentile(_ds,cdf,q):
+    """Linearly interpolate the distances at which each row of cdf reaches 
+    q"""
+    if len(_ds) < 2: return _ds[nu.zeros(cdf.shape[0],dtype='int')]
+    indx= nu.clip(nu.sum(cdf < q,axis=1),1,len(_ds)-1)
+    rows= nu.arange(cdf.shape[0])
+    lo, hi= cdf[rows,indx-1], cdf[rows,indx]
+    frac= nu.clip(nu.where(hi > lo,(q-lo)/(hi-lo),0.),0.,1.)
+    return _ds[indx-1]+frac*(_ds[indx]-_ds[indx-1])
+
+def _posteriors(grid,post,massbins):
+    """Turn the integrated PDFs for each isochrone (and mass bin) into the 
+    posteriors for each (Z,age) 'Zage' (nobj,nZ,nage), and if massbins is 
+    given, those for 'logage', 'Z', and 'mass'"""
+    out= {'Zage':post['Zage'].reshape((-1,len(grid.Zs()),
+                                       len(grid.logages())))}
+    if not massbins is None:
+        out['logage']= logsumexp(out['Zage'],axis=1)
+        out['Z']= logsumexp(out['Zage'],axis=2)
+        out['mass']= post['mass']
+    return out
+
+def _output(ds,out,logbound,cellout,post=None):
+    """Return out, preceded by ds and followed by logbound, cellout, and post
+    if these are not None"""
+    out= tuple([x for x in [ds,out,logbound,cellout,post] if not x is None])
+    if len(out) == 1: return out[0]
+    else: return out
+
+def _refine_distances(func,dmin,dmax,tol,ninit):
+    """Adaptively refine a distance grid: func(ds) returns the log PDF of a 
+    single object (1,len(ds)), None, and a log bound"""
+    _ds= nu.linspace(dmin,dmax,ninit)
+    out, dummy, logbound= func(_ds)
+    for ii in range(_MAXREFINE):
+        maxout= nu.amax(out)
+        if not nu.isfinite(maxout): break
+        pdf= nu.exp(out[0]-maxout)
+        mass= 0.5*(pdf[1:]+pdf[:-1])*(_ds[1:]-_ds[:-1])
+        refine= mass > tol*nu.sum(mass)
+        if not nu.any(refine): break
+        newds= 0.5*(_ds[1:]+_ds[:-1])[refine]
+        newout= func(newds)[0]
+        _ds= nu.concatenate((_ds,newds))
+        out= nu.concatenate((out,newout),axis=1)
+        sortindx= nu.argsort(_ds)
+        _ds, out= _ds[sortindx], out[:,sortindx]
+    return (_ds,out,logbound)
+
+def _lognorm(_ds,out):
+    """Log of the integral of exp(out) over distance (along the last axis), 
+    using cells that extend halfway to the neighboring distances (and 
+    symmetrically at the edges)"""
+    diff= _ds[1:]-_ds[:-1]
+    if nu.all(diff == diff[0]):
+        return logsumexp(out,axis=-1)+nu.log(_ds[1]-_ds[0])
+    return logsumexp(out+_logwidths(_ds),axis=-1)
+
+def _logwidths(_ds):
+    """Log of the width of the cell around each distance (see _lognorm)"""
+    if len(_ds) < 2: return nu.zeros(len(_ds))
+    diff= _ds[1:]-_ds[:-1]
+    width= nu.empty(len(_ds))
+    width[0], width[-1]= diff[0], diff[-1]
+    width[1:-1]= 0.5*(diff[1:]+diff[:-1])
+    return nu.log(width)
+
+def _load_grid(padova,padova_type,iso,imf=None):
+    if iso is None:
+        if not padova is None and isinstance(padova,PadovaIsochrone):
+            iso= padova
+        elif not padova is None and isinstance(padova,bool) and padova:
+            iso= PadovaIsochrone(type=padova_type)
+    if isinstance(iso,IsochroneGrid): return iso.weighted(imf)
+    else: return iso.grid().weighted(imf)
+
+def distmod_mixture(mdict=None,mivardict=None,logg=None,logg_ivar=None,
+                    teff=None,teff_ivar=None,logage=None,logage_ivar=None,
+                    Z=None,Z_ivar=None,feh=None,feh_ivar=None,
+                    afe=None,afe_ivar=None,
+                    padova=None,padova_type=None,iso=None,
+                    ageprior=None,logprior=None,imf=None,tol=30.,
+                    dmtol=None):
+    """
+    NAME:
+       distmod_mixture
+    PURPOSE:
+       compute the distance PDF of an object as a mixture of Gaussians in 
+       distance modulus (one per isochrone point, all with the same width), 
+       which can be evaluated for any distances with eval_distmod_mixture
+    INPUT:
+       mdict= dictionary of apparent magnitudes (e.g., {'J':12.,'Ks':13.})
+       mivardict= dictionary of magnitude inverse variances (matched to mdict)
+       logg=, logg_ivar=, teff=, teff_ivar=, logage=, logage_ivar=, Z=, 
+       Z_ivar=, feh=, feh_ivar=, afe=, afe_ivar=, padova=, padova_type=, 
+       iso=, ageprior=, logprior=, imf= as for eval_distpdf
+       tol= (30.) drop components whose amplitude is more than tol below
+            that of the largest component (None: keep all)
+       dmtol= (None) if set, merge components whose means are within 
+              dmtol x the width of the components
+    OUTPUT:
+       dictionary with the mixture: 'logamp' (log amplitudes), 'dm' (mean 
+       distance moduli), 'ivar' (common inverse variance; each component 
+       is exp(logamp-ivar*(dm-distance modulus)^2)), and 'logconst' (log of 
+       the distance-independent part of the PDF)
+    HISTORY:
+       2026-10-17 - Written - agent
+    """
+    grid= _load_grid(padova,padova_type,iso,imf)
+    obs= _parse_observations(mdict,mivardict,logg,logg_ivar,teff,teff_ivar,
+                             logage,logage_ivar,Z,Z_ivar,feh,feh_ivar,
+                             afe,afe_ivar,logprior)
+    mix= _mixture_chunk(grid,obs,ageprior)
+    logamp, dm= mix['block'](slice(None))
+    logamp, dm, ivar, logconst= logamp[0], dm[0], mix['ivar'][0], \
+        mix['logconst'][0]
+    if not tol is None and len(logamp) > 0:
+        indx= logamp >= nu.amax(logamp)-tol
+        logamp, dm= logamp[indx], dm[indx]
+    if not dmtol is None and ivar > 0. and len(logamp) > 0:
+        bins, inv= nu.unique(nu.floor(dm*nu.sqrt(ivar)/dmtol),
+                             return_inverse=True)
+        maxamp= nu.full(len(bins),-nu.inf)
+        nu.maximum.at(maxamp,inv,logamp)
+        weights= nu.exp(logamp-maxamp[inv])
+        sumweights= nu.bincount(inv,weights=weights)
+        dm= nu.bincount(inv,weights=weights*dm)/sumweights
+        logamp= maxamp+nu.log(sumweights)
+    return {'logamp':logamp,'dm':dm,'ivar':ivar,'logconst':logconst}
+
+def eval_distmod_mixture(ds,mixture,normalize=False):
+    """
+    NAME:
+       eval_distmod_mixture
+    PURPOSE:
+       evaluate the distance PDF of an object from its mixture of Gaussians
+       in distance modulus
+    INPUT:
+       ds- list or ndarray of distance (or a single distance), in kpc
+       mixture - output of distmod_mixture
+       normalize= if True, normalize output PDF (default: False)
+    OUTPUT:
+       log of probability
+    HISTORY:
+       2026-10-17 - Written - agent
+    """
+    _ds= nu.atleast_1d(nu.array(ds,dtype='float'))
+    out= _eval_mixture(_ds,{'logamp':mixture['logamp'][nu.newaxis],
+                            'dm':mixture['dm'][nu.newaxis],
+                            'ivar':nu.atleast_1d(mixture['ivar']),
+                            'logconst':nu.atleast_1d(mixture['logconst'])})\
+                            [0][0]
+    if normalize and len(_ds) > 1:
+        out-= _lognorm(_ds,out)
+    if nu.ndim(ds) == 0: return out[0]
     else: return out
 
+def _parse_observations(mdict,mivardict,logg,logg_ivar,teff,teff_ivar,
+                        logage,logage_ivar,Z,Z_ivar,feh,feh_ivar,afe,afe_ivar,
+                        logprior):
+    """Gather the observations of one or more objects in a dictionary of 
+    arrays of shape (nobj,) (or (1,) for inputs shared by all objects); 
+    missing magnitudes should have zero inverse variance; the log prior is
+    stored with shape (nobj,nZ,nage) (or (1,nZ,nage))"""
+    if not afe is None and feh is None:
+        raise ValueError("'afe=' requires 'feh=' (the alpha-enhancement correction is applied to [Fe/H]; give the metallicity as feh= rather than Z=)")
+    obs= {'mags':{},'ivars':{}}
+    for key in mdict.keys():
+        m, ivar= nu.broadcast_arrays(nu.atleast_1d(mdict[key]).astype('float'),
+                                     nu.atleast_1d(mivardict[key])\
+                                         .astype('float'))
+        obs['mags'][key]= nu.where(ivar > 0.,m,0.)
+        obs['ivars'][key]= ivar
+    for key, val in [('logg',logg),('logg_ivar',logg_ivar),
+                     ('teff',teff),('teff_ivar',teff_ivar),
+                     ('logage',logage),('logage_ivar',logage_ivar),
+                     ('Z',Z),('Z_ivar',Z_ivar),('feh',feh),('feh_ivar',feh_ivar),
+                     ('afe',afe),('afe_ivar',afe_ivar)]:
+        if val is None: obs[key]= None
+        else: obs[key]= nu.atleast_1d(val).astype('float')
+    if logprior is None: obs['logprior']= None
+    else:
+        obs['logprior']= nu.array(logprior,dtype='float')
+        if obs['logprior'].ndim < 3:
+            obs['logprior']= obs['logprior'][nu.newaxis]
+    nobjs= [len(obs['mags'][key]) for key in obs['mags']]\
+        +[len(obs[key]) for key in _OBSKEYS[::2]+['logprior']
+          if not obs[key] is None]
+    if len(nobjs) == 0: obs['nobj']= 1 #no per-object input: a single object
+    else: obs['nobj']= max(nobjs)
+    return obs
+
+def _chunk_observations(obs,chunk):
+    """Take a chunk of the objects (shared inputs apply to all objects)"""
+    out= {'mags':{},'ivars':{}}
+    for key in obs['mags']:
+        out['mags'][key]= _chunk(obs['mags'][key],chunk)
+        out['ivars'][key]= _chunk(obs['ivars'][key],chunk)
+    for key in _OBSKEYS+['logprior']:
+        out[key]= _chunk(obs[key],chunk)
+    out['nobj']= len(range(*chunk.indices(obs['nobj'])))
+    return out
+
+def _chunk(x,chunk):
+    if x is None: return None
+    if len(x) == 1: return x
+    else: return x[chunk]
+
+def _cell_logprior(grid,obs,ageprior):
+    """Log prior and age and metallicity constraints for each isochrone, 
+    shape (nobj,nZ,nage) (or (1,nZ,nage) if shared by all objects)"""
+    ZS= grid.Zs()
+    logages= grid.logages()
+    #age constraint and prior
+    ageterm= nu.zeros((1,len(logages)))
+    if not obs['logage'] is None:
+        ageterm= ageterm-(obs['logage'][:,nu.newaxis]-logages)**2.\
+            *obs['logage_ivar'][:,nu.newaxis]
+    if not ageprior is None:
+        if isinstance(ageprior,str) and ageprior.lower() == 'flat':
+            ageterm= ageterm+logages*_LOGTOLN
+    #metallicity constraints
+    Zterm= nu.zeros((1,len(ZS)))
+    if not obs['Z'] is None:
+        Zterm= Zterm-(obs['Z'][:,nu.newaxis]-ZS)**2.\
+            *obs['Z_ivar'][:,nu.newaxis]
+    if not obs['feh'] is None:
+        feh, feh_ivar= obs['feh'], obs['feh_ivar']
+        if not obs['afe'] is None:
+            #[M/H] of alpha-enhanced mixtures, Salaris et al. (1993)
+            falpha= 0.638*10.**obs['afe']
+            feh= feh+nu.log10(falpha+0.362)
+            if not obs['afe_ivar'] is None:
+                dfehdafe= falpha/(falpha+0.362)
+                feh_ivar= feh_ivar*obs['afe_ivar']\
+                    /(obs['afe_ivar']+feh_ivar*dfehdafe**2.)
+        Zterm= Zterm-(feh[:,nu.newaxis]-Z2FEH(ZS,zsolar=grid.zsolar,
+                                                parsec=grid.parsec))**2.\
+            *feh_ivar[:,nu.newaxis]
+    #Combine everything in a single broadcast
+    if obs['logprior'] is None: logprior= 0.
+    else: logprior= obs['logprior']
+    return Zterm[:,:,nu.newaxis]+ageterm[:,nu.newaxis,:]+logprior
+
+def _eval_chunk(grid,_ds,obs,ageprior,logwidth=None,massbins=None):
+    """Log PDF (nobj,len(_ds)), evaluating all isochrone points, and if 
+    logwidth (log of the width of each distance) is given, a dictionary 
+    with the log PDF integrated over distance for each isochrone 'Zage' 
+    (nobj,nZ*nage) and, if massbins (edges in initial mass) is given, for
+    each mass bin 'mass' (nobj,nbins) (else None)"""
+    nobj= obs['nobj']
+    ZS= grid.Zs()
+    logages= grid.logages()
+    logw= grid.logweights()
+    ncell, maxpts= len(ZS)*len(logages), logw.shape[2]
+    logw= logw.reshape((ncell,maxpts))
+    data= grid.datamask().reshape((ncell,maxpts))
+    logprior= _cell_logprior(grid,obs,ageprior).reshape((-1,1,ncell))
+    #Pre-calculate all absolute magnitudes, shape (nobj,nds,1,1)
+    absmagdict, ivardict= {}, {}
+    for key in obs['mags'].keys():
+        absmagdict[key]= (-_distmodulus(_ds)
+                           +obs['mags'][key][:,nu.newaxis])[:,:,nu.newaxis,
+                                                            nu.newaxis]
+        ivardict[key]= obs['ivars'][key][:,nu.newaxis,nu.newaxis,nu.newaxis]
+    teff, logg= obs['teff'], obs['logg']
+    if not teff is None:
+        teff= teff[:,nu.newaxis,nu.newaxis,nu.newaxis]
+        teff_ivar= obs['teff_ivar'][:,nu.newaxis,nu.newaxis,nu.newaxis]
+    if not logg is None:
+        logg= logg[:,nu.newaxis,nu.newaxis,nu.newaxis]
+        logg_ivar= obs['logg_ivar'][:,nu.newaxis,nu.newaxis,nu.newaxis]
+    #Evaluate the likelihood for blocks of isochrones and accumulate
+    out= _LogSumExpAccumulator((nobj,len(_ds)))
+    if logwidth is None: post= None
+    else:
+        post= {'Zage':nu.empty((nobj,ncell))}
+        if not massbins is None:
+            massbin= _massbin(grid,massbins).reshape((ncell,maxpts))
+            massout= _LogSumExpAccumulator((nobj,len(massbins)-1))
+    nblock= max(1,_BLOCKSIZE//(nobj*len(_ds)*maxpts))
+    for start in range(0,ncell,nblock):
+        cells= slice(start,min(start+nblock,ncell))
+        thisdata= data[cells]
+        loglike= nu.empty((nobj,len(_ds),thisdata.shape[0],maxpts))
+        loglike[:]= logw[cells]
+        if not teff is None:
+            loglike-= nu.where(thisdata,
+                               (teff-grid['Teff'].reshape((ncell,maxpts))\
+                                    [cells])**2.*teff_ivar,0.)
+        if not logg is None:
+            loglike-= nu.where(thisdata,
+                               (logg-grid['logg'].reshape((ncell,maxpts))\
+                                    [cells])**2.*logg_ivar,0.)
+        for key in absmagdict.keys():
+            loglike-= nu.where(thisdata,
+                               (absmagdict[key]
+                                -grid[key].reshape((ncell,maxpts))[cells])**2.\
+                                   *ivardict[key],0.)
+        if not post is None and not massbins is None:
+            thisbin= massbin[cells]
+            inbin= thisbin >= 0
+            massout.scatter((logsumexp(loglike
+                                       +logwidth[:,nu.newaxis,nu.newaxis],
+                                       axis=1)
+                             +logprior[:,0,cells,nu.newaxis])[:,inbin],
+                            thisbin[inbin])
+        #marginalize over mass and add priors
+        loglike= logsumexp(loglike,axis=3)+logprior[:,:,cells]
+        #marginalize over metallicity and age
+        out.add(loglike,axis=2)
+        if not post is None:
+            post['Zage'][:,cells]= logsumexp(loglike
+                                             +logwidth[:,nu.newaxis],axis=1)
+    if not post is None and not massbins is None:
+        post['mass']= massout.result()
+    return (out.result(),post)
+
+def _massbin(grid,massbins):
+    """Index of the initial-mass bin of each (flattened) point of the grid,
+    -1 for points outside of the bins"""
+    mass= grid[grid._masskey].flatten()
+    with nu.errstate(invalid='ignore'):
+        inbins= (mass >= massbins[0])*(mass < massbins[-1])
+    out= nu.full(len(mass),-1,dtype='int')
+    out[inbins]= nu.searchsorted(massbins,mass[inbins],side='right')-1
+    return out
+
+def _default_massbins(grid,nbins=20):
+    """Logarithmically-spaced initial-mass bins that cover the grid"""
+    mass= grid[grid._masskey][grid.validmask()]
+    mass= mass[mass > 0.]
+    out= nu.exp(nu.linspace(nu.log(nu.amin(mass)),nu.log(nu.amax(mass)),
+                            nbins+1))
+    #exact edges, such that the lowest and highest masses are in the bins
+    out[0]= nu.amin(mass)
+    out[-1]= nu.nextafter(nu.amax(mass),nu.inf)
+    return out
+
+def _mixture_chunk(grid,obs,ageprior,pindx=None):
+    """Mixture of Gaussians in distance modulus for each object: returns a
+    dictionary with a function 'block' that returns the log amplitudes and
+    means (nobj,n) of a slice of the 'ncomp' components (such that they 
+    are only computed one block at a time), their grid points 'pindx' and
+    isochrones 'cell', their inverse variances 'ivar' (nobj,), and the log
+    of the distance-independent part 'logconst' (nobj,), which consists of
+    the grid points 'cindx' with log amplitudes 'constamp' and is 
+    'cellconst' (nobj,nZ*nage) for each isochrone; pindx= flat indices of
+    the data points to include (default: all)"""
+    nobj= obs['nobj']
+    maxpts= grid.logweights().shape[2]
+    logw= grid.logweights().reshape(-1)
+    data= grid.datamask().reshape(-1)
+    logprior= _cell_logprior(grid,obs,ageprior)
+    logprior= logprior.reshape((logprior.shape[0],-1))
+    #Points that enter with their magnitudes, logg, and Teff
+    if pindx is None: pindx= nu.flatnonzero(data)
+    A= nu.zeros(nobj)
+    for key in obs['mags'].keys():
+        A= A+obs['ivars'][key]
+    #Points that only contribute their weight
+    cindx= nu.flatnonzero((True^data)
+                          *(logw > nu.finfo(nu.dtype(nu.float64)).min))
+    constamp= nu.broadcast_to(logw[cindx]+logprior[:,cindx//maxpts],
+                              (nobj,len(cindx)))
+    cellconst= _LogSumExpAccumulator((nobj,logprior.shape[1]))
+    cellconst.scatter(constamp,cindx//maxpts)
+    cellconst= cellconst.result()
+    logconst= _LogSumExpAccumulator((nobj,))
+    logconst.add(cellconst,axis=1)
+    return {'block':lambda comps: _mixture_block(grid,obs,logprior,A,
+                                                 pindx[comps]),
+            'ncomp':len(pindx),'ivar':A,'logconst':logconst.result(),
+            'pindx':pindx,'cell':pindx//maxpts,'cindx':cindx,
+            'constamp':constamp,'cellconst':cellconst}
+
+def _mixture_block(grid,obs,logprior,A,pindx):
+    """Log amplitudes and means (nobj,len(pindx)) of the mixture components
+    of the data points pindx (see _mixture_chunk)"""
+    nobj= obs['nobj']
+    maxpts= grid.logweights().shape[2]
+    logamp= grid.logweights().reshape(-1)[pindx]+logprior[:,pindx//maxpts]
+    if not obs['teff'] is None:
+        logamp= logamp-(obs['teff'][:,nu.newaxis]
+                        -grid['Teff'].reshape(-1)[pindx])**2.\
+                        *obs['teff_ivar'][:,nu.newaxis]
+    if not obs['logg'] is None:
+        logamp= logamp-(obs['logg'][:,nu.newaxis]
+                        -grid['logg'].reshape(-1)[pindx])**2.\
+                        *obs['logg_ivar'][:,nu.newaxis]
+    #sum_k ivar_k (m_k-M_k-dm)^2 = A (dm-B/A)^2 + C-B^2/A
+    B= nu.zeros((nobj,len(pindx)))
+    C= nu.zeros((nobj,len(pindx)))
+    for key in obs['mags'].keys():
+        ivar= obs['ivars'][key][:,nu.newaxis]
+        dmag= obs['mags'][key][:,nu.newaxis]-grid[key].reshape(-1)[pindx]
+        B+= ivar*dmag
+        C+= ivar*dmag**2.
+    _A= nu.where(A > 0.,A,1.)[:,nu.newaxis]
+    dm= nu.where(A[:,nu.newaxis] > 0.,B/_A,0.)
+    return (nu.broadcast_to(logamp-(C-dm*B),(nobj,len(pindx))),dm)
+
+def _eval_mixture(_ds,mix,logwidth=None,massbin=None,nmassbins=None):
+    """Log PDF (nobj,len(_ds)) from mixtures of Gaussians in distance 
+    modulus (see _mixture_chunk; or with all log amplitudes and means in
+    'logamp' and 'dm' (nobj,ncomp) instead of 'block') and if logwidth (log
+    of the width of each distance) is given, a dictionary with the log PDF
+    integrated over distance for each isochrone 'Zage' and, if massbin (bin
+    of each grid point, see _massbin) is given, for each of the nmassbins 
+    mass bins 'mass' (else None)"""
+    ivar= mix['ivar']
+    if 'block' in mix: block, ncomp= mix['block'], mix['ncomp']
+    else:
+        block= lambda comps: (mix['logamp'][:,comps],mix['dm'][:,comps])
+        ncomp= mix['logamp'].shape[1]
+    nobj= len(mix['logconst'])
+    distmod= _distmodulus(_ds)[nu.newaxis,:,nu.newaxis]
+    out= _LogSumExpAccumulator((nobj,len(_ds)))
+    out.add(mix['logconst'][:,nu.newaxis,nu.newaxis],axis=2)
+    if logwidth is None: post= None
+    else:
+        post= {'Zage':_LogSumExpAccumulator(mix['cellconst'].shape)}
+        post['Zage'].add(mix['cellconst'][:,:,nu.newaxis]
+                         +logsumexp(logwidth),axis=2)
+        if not massbin is None:
+            post['mass']= _LogSumExpAccumulator((nobj,nmassbins))
+            thisbin= massbin[mix['cindx']]
+            inbin= thisbin >= 0
+            post['mass'].scatter(mix['constamp'][:,inbin]+logsumexp(logwidth),
+                                 thisbin[inbin])
+            compbin= massbin[mix['pindx']]
+    nblock= max(1,_BLOCKSIZE//(nobj*len(_ds)))
+    for start in range(0,ncomp,nblock):
+        comps= slice(start,min(start+nblock,ncomp))
+        logamp, dm= block(comps)
+        loglike= logamp[:,nu.newaxis]-ivar[:,nu.newaxis,nu.newaxis]\
+            *(distmod-dm[:,nu.newaxis])**2.
+        out.add(loglike,axis=2)
+        if not post is None:
+            comppost= logsumexp(loglike+logwidth[:,nu.newaxis],axis=1)
+            post['Zage'].scatter(comppost,mix['cell'][comps])
+            if not massbin is None:
+                thisbin= compbin[comps]
+                inbin= thisbin >= 0
+                post['mass'].scatter(comppost[:,inbin],thisbin[inbin])
+    if not post is None:
+        post= dict((key,post[key].result()) for key in post)
+    return (out.result(),post)
+
+def _eval_chunk_gaussian(grid,_ds,obs,ageprior,logwidth=None,massbins=None):
+    """Log PDF (nobj,len(_ds)), combining the magnitudes of each isochrone
+    point into a Gaussian in distance modulus, and the integrated PDF for 
+    each isochrone and mass bin (see _eval_chunk)"""
+    return _eval_mixture(_ds,_mixture_chunk(grid,obs,ageprior),
+                         logwidth=logwidth,
+                         massbin=None if massbins is None
+                         else _massbin(grid,massbins),
+                         nmassbins=None if massbins is None
+                         else len(massbins)-1)
+
+_ENGINES= {'grid':_eval_chunk,'gaussian':_eval_chunk_gaussian}
+
+def _prune_points(grid,obs,ageprior,k):
+    """Flat indices of the data points within k sigma of the colors, logg,
+    and Teff of a single object and the log of an upper bound on the 
+    contribution of all other data points: a point that is more than 
+    k sigma away in any of these has a likelihood < exp(-k^2) x its weight
+    at all distances"""
+    bands= [key for key in obs['mags'].keys() if obs['ivars'][key][0] > 0.]
+    bands.sort(key=lambda b: -obs['ivars'][b][0])
+    colors= [(b,bands[0]) for b in bands[1:]]
+    x= [obs['mags'][b][0]-obs['mags'][bands[0]][0] for b in bands[1:]]
+    sigma= [nu.sqrt(1./obs['ivars'][b][0]+1./obs['ivars'][bands[0]][0])
+            for b in bands[1:]]
+    uselogg= not obs['logg'] is None and obs['logg_ivar'][0] > 0.
+    if uselogg:
+        x.append(obs['logg'][0])
+        sigma.append(1./nu.sqrt(obs['logg_ivar'][0]))
+    useteff= not obs['teff'] is None and obs['teff_ivar'][0] > 0.
+    if useteff:
+        x.append(obs['teff'][0])
+        sigma.append(1./nu.sqrt(obs['teff_ivar'][0]))
+    if len(x) == 0:
+        return (nu.flatnonzero(grid.datamask()),-nu.inf)
+    tree, scale, index, features= grid.kdtree(colors=colors,logg=uselogg,
+                                              teff=useteff)
+    x, sigma= nu.array(x), nu.array(sigma)
+    #Query a box that contains the k-sigma region, then cut exactly
+    cand= nu.array(tree.query_ball_point(x/scale,k*nu.amax(sigma/scale),
+                                         p=nu.inf),dtype='int')
+    cand= cand[nu.all(nu.fabs(features[cand]-x) <= k*sigma,axis=1)]
+    keep= nu.zeros(len(index),dtype='bool')
+    keep[cand]= True
+    keep[tree.n:]= True #points with non-finite features are always kept
+    pindx= nu.sort(index[keep])
+    skipped= index[True^keep]
+    if len(skipped) == 0:
+        return (pindx,-nu.inf)
+    maxpts= grid.logweights().shape[2]
+    logprior= _cell_logprior(grid,obs,ageprior).reshape((1,-1))
+    logbound= logsumexp(grid.logweights().flatten()[skipped]
+                        +logprior[0,skipped//maxpts])-k**2.
+    return (pindx,logbound)
+
+def _eval_pruned(grid,_ds,obs,ageprior,k,logwidth=None,massbins=None):
+    """Log PDF (nobj,len(_ds)), integrated PDFs (see _eval_chunk), and log 
+    bound (nobj,), evaluating only the points close to each object in 
+    color, logg, and Teff"""
+    out= nu.empty((obs['nobj'],len(_ds)))
+    post= None
+    logbound= nu.empty(obs['nobj'])
+    if not massbins is None:
+        massbin= _massbin(grid,massbins)
+    for ii in range(obs['nobj']):
+        thisobs= _chunk_observations(obs,slice(ii,ii+1))
+        pindx, logbound[ii]= _prune_points(grid,thisobs,ageprior,k)
+        thisout, thispost= \
+            _eval_mixture(_ds,_mixture_chunk(grid,thisobs,ageprior,
+                                             pindx=pindx),
+                          logwidth=logwidth,
+                          massbin=None if massbins is None else massbin,
+                          nmassbins=None if massbins is None 
+                          else len(massbins)-1)
+        out[ii]= thisout[0]
+        if not thispost is None:
+            if post is None:
+                post= dict((key,nu.empty((obs['nobj'],)
+                                         +thispost[key].shape[1:]))
+                           for key in thispost)
+            for key in thispost: post[key][ii]= thispost[key][0]
+    return (out,post,logbound)
+
+class _SlabPool:
+    """Pool of processes that evaluate the PDF for slabs of metallicities;
+    the slabs of the isochrone grid are given to each process once when it
+    starts (and inherited without copying when the platform can fork) and
+    keep the KD-trees that the process builds for them between calls"""
+    def __init__(self,grid,nslab):
+        self._grid= grid
+        self._nslab= nslab
+        self._zs= [slice(s[0],s[-1]+1)
+                   for s in nu.array_split(nu.arange(len(grid.Zs())),nslab)]
+        slabs= [grid.slab(zs) for zs in self._zs]
+        try:
+            context= multiprocessing.get_context('fork')
+        except (AttributeError,ValueError):
+            context= multiprocessing
+        self._pool= context.Pool(nslab,initializer=_init_slab_worker,
+                                 initargs=(slabs,))
+        return None
+
+    @classmethod
+    def open(cls,grid,n_workers):
+        """Return the pool of the grid for n_workers (started on first use
+        and kept on the grid, replacing the pool of another weighting of the
+        grid or number of workers), or None if n_workers does not ask for 
+        one"""
+        if n_workers is None or n_workers < 2 or len(grid.Zs()) < 2:
+            return None
+        nslab= min(n_workers,len(grid.Zs()))
+        pool= grid._pools.get('pool')
+        if pool is None or not pool._grid is grid or pool._nslab != nslab:
+            grid.close()
+            grid._pools['pool']= cls(grid,nslab)
+        return grid._pools['pool']
+
+    def close(self):
+        """Stop the processes (once they finish their work)"""
+        self._pool.close()
+        self._pool.join()
+        return None
+
+    def eval(self,_ds,obs,ageprior,engine,prune,logwidth,massbins):
+        """Evaluate all slabs and merge their partial log-sum-exps"""
+        results= self._pool.map(_eval_slab,
+                                [(ii,zs,_ds,obs,ageprior,engine,prune,
+                                  logwidth,massbins)
+                                 for ii,zs in enumerate(self._zs)])
+        out= _LogSumExpAccumulator(results[0][0].shape)
+        logbound= _LogSumExpAccumulator(results[0][2].shape)
+        for thisout, thispost, thisbound in results:
+            out.add(thisout[...,nu.newaxis],axis=-1)
+            logbound.add(thisbound[...,nu.newaxis],axis=-1)
+        if logwidth is None: post= None
+        else:
+            post= {'Zage':nu.concatenate([r[1]['Zage'] for r in results],
+                                         axis=1)}
+            if not massbins is None:
+                post['mass']= _LogSumExpAccumulator(results[0][1]['mass']\
+                                                        .shape)
+                for r in results:
+                    post['mass'].add(r[1]['mass'][...,nu.newaxis],axis=-1)
+                post['mass']= post['mass'].result()
+        return (out.result(),post,logbound.result())
+
+_SLABGRIDS= None #slabs of the grid of the current slab-pool process
+def _init_slab_worker(slabs):
+    global _SLABGRIDS
+    _SLABGRIDS= slabs
+    return None
+
+def _eval_slab(args):
+    ii, zs, _ds, obs, ageprior, engine, prune, logwidth, massbins= args
+    if not obs['logprior'] is None:
+        obs= dict(obs,logprior=obs['logprior'][:,zs])
+    return _eval_distances(_SLABGRIDS[ii],_ds,obs,ageprior,engine,prune,
+                           logwidth=logwidth,massbins=massbins)
+
+class _LogSumExpAccumulator:
+    """Running log(sum(exp(x))), keeping the maximum and the sum of 
+    exp(x-maximum) such that blocks of x can be folded in one at a time"""
+    def __init__(self,shape):
+        self._max= nu.full(shape,-nu.inf)
+        self._sum= nu.zeros(shape)
+
+    def _rescale(self,newmax):
+        """Rescale the running sum to a new (larger) maximum"""
+        shift= nu.where(nu.isfinite(newmax),newmax,0.)
+        self._sum*= nu.exp(self._max-shift)
+        self._max= newmax
+        return shift
+
+    def add(self,x,axis):
+        """Fold in x, reducing it along axis"""
+        shift= self._rescale(nu.maximum(self._max,nu.amax(x,axis=axis)))
+        self._sum+= nu.sum(nu.exp(x-nu.expand_dims(shift,axis)),axis=axis)
+        return None
+
+    def scatter(self,x,indx):
+        """Fold in x (...,m), adding x[...,ii] to element indx[ii] of the
+        last axis"""
+        blockmax= nu.full(self._max.shape,-nu.inf)
+        nu.maximum.at(blockmax,(Ellipsis,indx),x)
+        shift= self._rescale(nu.maximum(self._max,blockmax))
+        nu.add.at(self._sum,(Ellipsis,indx),nu.exp(x-shift[...,indx]))
+        return None
+
+    def result(self):
+        with nu.errstate(divide='ignore'):
+            return self._max+nu.log(self._sum)
+
 def _distmodulus(d):
     return 5.*nu.log10(d/.01)
@@ -1,10 +1,13 @@
 ###############################################################################
 # isodist.imf: various IMF models
 #
-#  These all return dN/dM
+#  These all return dN/dM, or N(<M) with int=True (in closed form);
+#  cumulative(imf,m) returns N(<M) for any IMF function;
+#  PiecewisePowerLaw(slopes,breaks) defines other broken power-law IMFs;
+#  sample(imf,n,mmin,mmax) draws masses from any IMF by inverting N(<M)
 ###############################################################################
 import numpy
-from scipy import integrate
+from scipy import special
 _LOGMOLOGNORMALCHABRIER2001= numpy.log10(0.1)
 _S2LOGNORMALCHABRIER2001= 0.627**2.
 _LOGMOLOGNORMALCHABRIER2003= numpy.log10(0.079)
@@ -13,6 +16,21 @@ _ALPHAEXPONENTIALCHABRIER2001= 3.3
 _BETAEXPONENTIALCHABRIER2001= 0.25
 _MOEXPONENTIALCHABRIER2001= 716.4
 _LOGLN= numpy.log(10.)
+#Kroupa (2003) as dN/dM= coeff x M^-slope between the edges
+_KROUPA2003EDGES= numpy.array([0.,0.08,0.5,numpy.inf])
+_KROUPA2003SLOPES= numpy.array([0.3,1.3,2.3])
+_KROUPA2003COEFFS= numpy.array([0.08**0.3,0.08**1.3,
+                                0.5**2.3*(0.5/0.08)**-1.3])
+#Chabrier (2003) power-law part above 1 Msun
+_CHABRIER2003PL= 0.158*numpy.exp(-_LOGMOLOGNORMALCHABRIER2003**2./2.\
+                                      /_S2LOGNORMALCHABRIER2003)/_LOGLN
+#Tabulated N(<M) of other IMFs: log10 M grid, cached per function
+_TABLELOGMMIN= -4.
+_TABLELOGMMAX= 3.
+_TABLENPTS= 20001
+_TABLES= {}
+#Number of masses drawn at once by sample_chunks
+_SAMPLECHUNKSIZE= 2**20
 import sys
 _PY3= sys.version > '3'
 if _PY3:
@@ -32,19 +50,7 @@ def lognormalChabrier2001(m,int=False):
        2012-02-08 - Written - Bovy (IAS)
     """
     if int:
-        if isinstance(m,(long,float)):
-            m= [m]
-            scalarOut= True
-        else:
-            scalarOut= False
-        out= numpy.zeros(len(m))
-        for ii in range(len(m)):
-            out[ii]= integrate.quad(_intLognormalChabrier2001Integrand,
-                                    0.,
-                                    m[ii])[0]
-        if isinstance(m,list): return list(out)
-        elif scalarOut: return out[0]
-        else: return out
+        return _intOutput(m,_cdfLognormalChabrier2001(numpy.array(m,dtype='float')))
     else:
         return 0.141/m*numpy.exp(-(numpy.log10(m)-_LOGMOLOGNORMALCHABRIER2001)**2./2./_S2LOGNORMALCHABRIER2001)/_LOGLN
 
@@ -63,19 +69,7 @@ def exponentialChabrier2001(m,int=False):
        2012-02-08 - Written - Bovy (IAS)
     """
     if int:
-        if isinstance(m,(long,float)):
-            m= [m]
-            scalarOut= True
-        else:
-            scalarOut= False
-        out= numpy.zeros(len(m))
-        for ii in range(len(m)):
-            out[ii]= integrate.quad(_intExponentialChabrier2001Integrand,
-                                    0.,
-                                    m[ii])[0]
-        if isinstance(m,list): return list(out)
-        elif scalarOut: return out[0]
-        else: return out
+        return _intOutput(m,_cdfExponentialChabrier2001(numpy.array(m,dtype='float')))
     else:
         return 3.*m**-_ALPHAEXPONENTIALCHABRIER2001*numpy.exp(-(_MOEXPONENTIALCHABRIER2001/m)**_BETAEXPONENTIALCHABRIER2001)
 
@@ -94,19 +88,7 @@ def kroupa2003(m,int=False):
        2012-02-08 - Written - Bovy (IAS)
     """
     if int:
-        if isinstance(m,(long,float)):
-            m= [m]
-            scalarOut= True
-        else:
-            scalarOut= False
-        out= numpy.zeros(len(m))
-        for ii in range(len(m)):
-            out[ii]= integrate.quad(_intKroupa2003Integrand,
-                                    0.,
-                                    m[ii])[0]
-        if isinstance(m,list): return list(out)
-        elif scalarOut: return out[0]
-        else: return out
+        return _intOutput(m,_cdfKroupa2003(numpy.array(m,dtype='float')))
     else:
         if isinstance(m,(long,float)):
             if m < 0.08: return (m/0.08)**-0.3
@@ -137,19 +119,7 @@ def chabrier2003(m,int=False):
        2012-02-08 - Written - Bovy (IAS)
     """
     if int:
-        if isinstance(m,(long,float)):
-            m= [m]
-            scalarOut= True
-        else:
-            scalarOut= False
-        out= numpy.zeros(len(m))
-        for ii in range(len(m)):
-            out[ii]= integrate.quad(_intChabrier2003Integrand,
-                                    0.,
-                                    m[ii])[0]
-        if isinstance(m,list): return list(out)
-        elif scalarOut: return out[0]
-        else: return out
+        return _intOutput(m,_cdfChabrier2003(numpy.array(m,dtype='float')))
     else:
         if isinstance(m,(long,float)):
             if m < 1.: return 0.158/m*numpy.exp(-(numpy.log10(m)-_LOGMOLOGNORMALCHABRIER2003)**2./2./_S2LOGNORMALCHABRIER2003)/_LOGLN
@@ -163,11 +133,297 @@ def chabrier2003(m,int=False):
             out[(m >= 1.)]= m[(m >= 1.)]**-2.3*0.158*numpy.exp(-_LOGMOLOGNORMALCHABRIER2003**2./2./_S2LOGNORMALCHABRIER2003)/_LOGLN
             return out
 
-def _intLognormalChabrier2001Integrand(m):
-    return lognormalChabrier2001(m,int=False)
-def _intExponentialChabrier2001Integrand(m):
-    return exponentialChabrier2001(m,int=False)
-def _intKroupa2003Integrand(m):
-    return kroupa2003(m,int=False)
-def _intChabrier2003Integrand(m):
-    return chabrier2003(m,int=False)
+def cumulative(imf,m):
+    """
+    NAME:
+       cumulative
+    PURPOSE:
+       return the integrated IMF N(<m) for any IMF function
+    INPUT:
+       imf - IMF function (one of the IMFs in this module, which are 
+             integrated in closed form, or any function of mass that 
+             returns dN/dm for an array of masses, which is integrated 
+             numerically once on a fine grid in log mass between 1e-4 and 
+             1e3 Msun, extrapolated as a power law below that, and 
+             interpolated)
+       m - mass in solar masses
+    OUTPUT:
+       N(<m)
+    HISTORY:
+       2026-10-17 - Written - agent
+    """
+    return _intOutput(m,_cdf(imf)(numpy.array(m,dtype='float')))
+
+def sample(imf,n,mmin,mmax,rng=None,chunksize=_SAMPLECHUNKSIZE):
+    """
+    NAME:
+       sample
+    PURPOSE:
+       draw masses from an IMF
+    INPUT:
+       imf - IMF function (one of the IMFs in this module or a 
+             PiecewisePowerLaw instance, which are inverted analytically, or
+             any function of mass that returns dN/dm for an array of masses,
+             which is inverted using the tabulated N(<m) of cumulative)
+       n - number of masses to draw
+       mmin, mmax - mass range in solar masses
+       rng= numpy.random.Generator or seed for numpy.random.default_rng 
+            (default: None, fresh entropy)
+       chunksize= number of masses drawn at once, which bounds the size of 
+                  the temporary arrays (the output does not depend on it)
+    OUTPUT:
+       array of n masses
+    HISTORY:
+       2026-10-17 - Written - agent
+    """
+    out= numpy.empty(n)
+    start= 0
+    for chunk in sample_chunks(imf,n,mmin,mmax,rng=rng,chunksize=chunksize):
+        out[start:start+len(chunk)]= chunk
+        start+= len(chunk)
+    return out
+
+def sample_chunks(imf,n,mmin,mmax,rng=None,chunksize=_SAMPLECHUNKSIZE):
+    """
+    NAME:
+       sample_chunks
+    PURPOSE:
+       draw masses from an IMF, yielding them in chunks (for samples that
+       do not fit in memory)
+    INPUT:
+       imf, n, mmin, mmax, rng= as for sample
+       chunksize= maximum number of masses in each chunk
+    OUTPUT:
+       generator of arrays of masses, n in total
+    HISTORY:
+       2026-10-17 - Written - agent
+    """
+    if not isinstance(rng,numpy.random.Generator):
+        rng= numpy.random.default_rng(rng)
+    cdf, ppf= _cdf(imf), _ppf(imf)
+    nmin, nmax= cdf(numpy.array([mmin,mmax],dtype='float'))
+    if not nmax > nmin:
+        raise ValueError("IMF has no stars between mmin and mmax")
+    for start in range(0,n,chunksize):
+        u= rng.random(min(chunksize,n-start))
+        yield numpy.clip(ppf(nmin+u*(nmax-nmin)),mmin,mmax)
+
+class PiecewisePowerLaw:
+    """Broken power-law IMF dN/dM ~ M^-slopes[i] between the breaks, which
+    behaves like the IMF functions in this module"""
+    def __init__(self,slopes,breaks=[],mmin=0.):
+        """
+        NAME:
+           __init__
+        PURPOSE:
+           initialize
+        INPUT:
+           slopes - power-law slopes alpha_i of dN/dM ~ M^-alpha_i (e.g., 
+                    [1.3,2.3])
+           breaks= masses of the breaks between the slopes (e.g., [0.5]); 
+                   dN/dM is continuous and equal to one at the first break
+                   (at 1 Msun without breaks)
+           mmin= lower mass limit (default: 0.; has to be > 0 if the first
+                 slope is >= 1)
+        OUTPUT:
+        HISTORY:
+           2026-10-17 - Written - agent
+        """
+        self._slopes= numpy.array(slopes,dtype='float',ndmin=1)
+        breaks= numpy.array(breaks,dtype='float',ndmin=1)
+        if len(breaks) != len(self._slopes)-1:
+            raise ValueError("PiecewisePowerLaw needs len(slopes)-1 breaks")
+        if numpy.any(numpy.diff(breaks) <= 0.) \
+                or (len(breaks) > 0 and breaks[0] <= mmin):
+            raise ValueError("PiecewisePowerLaw breaks have to be increasing and above mmin")
+        if mmin <= 0. and self._slopes[0] >= 1.:
+            raise ValueError("N(<M) of PiecewisePowerLaw diverges for mmin=0; set mmin > 0")
+        self._edges= numpy.concatenate(([mmin],breaks,[numpy.inf]))
+        self._coeffs= numpy.ones(len(self._slopes))
+        if len(breaks) > 0:
+            self._coeffs[0]= breaks[0]**self._slopes[0]
+        for ii in range(len(breaks)):
+            self._coeffs[ii+1]= self._coeffs[ii]\
+                *breaks[ii]**(self._slopes[ii+1]-self._slopes[ii])
+        return None
+
+    def __call__(self,m,int=False):
+        """
+        NAME:
+           __call__
+        PURPOSE:
+           evaluate the IMF
+        INPUT:
+           m - mass in solar masses
+           int= (default: False) if True, return integrated N(<m)
+        OUTPUT:
+           dN/dm
+        HISTORY:
+           2026-10-17 - Written - agent
+        """
+        if int:
+            return _intOutput(m,self._cdf(numpy.array(m,dtype='float')))
+        _m= numpy.array(m,dtype='float')
+        indx= numpy.clip(numpy.searchsorted(self._edges,_m,side='right')-1,
+                         0,len(self._slopes)-1)
+        out= numpy.where(_m >= self._edges[0],
+                         self._coeffs[indx]*_m**-self._slopes[indx],0.)
+        return _intOutput(m,out)
+
+    def _cdf(self,m):
+        return _cdfPowerlaw(m,self._edges,self._slopes,self._coeffs)
+
+    def _ppf(self,n):
+        return _ppfPowerlaw(n,self._edges,self._slopes,self._coeffs)
+
+def _lookup(imf):
+    """Return the IMF function with this name (or imf if it is not a name)"""
+    if not isinstance(imf,str): return imf
+    names= dict((func.__name__,func) for func in _CDFS)
+    if not imf in names:
+        raise ValueError("Unknown IMF '%s'; use one of %s" \
+                             % (imf,', '.join(sorted(names))))
+    return names[imf]
+
+def _cdf(imf):
+    """Function that returns N(<m) of an IMF for an array of masses"""
+    if imf in _CDFS: return _CDFS[imf]
+    elif isinstance(imf,PiecewisePowerLaw): return imf._cdf
+    logm, table, alpha= _table(imf)
+    def cdf(m):
+        with numpy.errstate(divide='ignore'):
+            return numpy.interp(numpy.log10(m),logm,table,left=0.)
+    return cdf
+
+def _ppf(imf):
+    """Function that returns the mass at which N(<m) reaches n (inverse
+    of _cdf) for an array of n"""
+    if imf in _PPFS: return _PPFS[imf]
+    elif isinstance(imf,PiecewisePowerLaw): return imf._ppf
+    logm, table, alpha= _table(imf)
+    def ppf(n):
+        out= 10.**numpy.interp(n,table,logm)
+        #invert the power-law extrapolation below the grid
+        below= n < table[0]
+        out[below]= 10.**logm[0]*(n[below]/table[0])**(1./(1.-alpha))
+        return out
+    return ppf
+
+def _table(imf):
+    """Tabulated N(<m) of an IMF function on a grid in log10 m (cached)"""
+    if not imf in _TABLES:
+        logm= numpy.linspace(_TABLELOGMMIN,_TABLELOGMMAX,_TABLENPTS)
+        integrand= numpy.atleast_1d(imf(10.**logm))*10.**logm*_LOGLN
+        #below the grid, extrapolate dN/dM as a power law M^-alpha
+        with numpy.errstate(divide='ignore',invalid='ignore'):
+            alpha= 1.-numpy.log(integrand[1]/integrand[0])\
+                /(logm[1]-logm[0])/_LOGLN
+        table= numpy.zeros(_TABLENPTS)
+        if alpha < 1.: table+= integrand[0]/_LOGLN/(1.-alpha)
+        table[1:]+= numpy.cumsum(0.5*(integrand[1:]+integrand[:-1]))\
+            *(logm[1]-logm[0])
+        _TABLES[imf]= (logm,table,alpha)
+    return _TABLES[imf]
+
+def _intOutput(m,out):
+    """Return N(<m) as the same type as m"""
+    if isinstance(m,list): return list(numpy.atleast_1d(out))
+    elif isinstance(m,(long,float)): return float(out)
+    else: return out
+
+def _cdfPowerlaw(m,edges,slopes,coeffs):
+    """N(<m) of dN/dM= coeffs[i] x M^-slopes[i] for edges[i] <= M < edges[i+1]
+    (edges[0] has to be zero or the first slope < 1)"""
+    out= numpy.zeros(m.shape)
+    for ii in range(len(slopes)):
+        lo= edges[ii]
+        hi= numpy.clip(m,lo,edges[ii+1])
+        if slopes[ii] == 1.:
+            out+= coeffs[ii]*numpy.log(hi/lo)
+        else:
+            out+= coeffs[ii]*(hi**(1.-slopes[ii])-lo**(1.-slopes[ii]))\
+                /(1.-slopes[ii])
+    return out
+
+def _ppfPowerlaw(n,edges,slopes,coeffs):
+    """Inverse of _cdfPowerlaw"""
+    nedges= _cdfPowerlaw(edges[:-1],edges,slopes,coeffs)
+    indx= numpy.clip(numpy.searchsorted(nedges,n,side='right')-1,
+                     0,len(slopes)-1)
+    lo, slope, coeff= edges[indx], slopes[indx], coeffs[indx]
+    dn= n-nedges[indx]
+    one= slope == 1.
+    with numpy.errstate(divide='ignore',invalid='ignore'):
+        out= (lo**(1.-slope)+dn*(1.-slope)/coeff)**(1./(1.-slope))
+        out[one]= (lo*numpy.exp(dn/coeff))[one]
+    return out
+
+def _cdfLognormal(m,norm,logmo,s2):
+    """N(<m) of dN/dM= norm/M/ln(10) exp(-(log10 M-logmo)^2/2/s2)"""
+    with numpy.errstate(divide='ignore'):
+        x= (numpy.log10(m)-logmo)/numpy.sqrt(2.*s2)
+    return norm*numpy.sqrt(numpy.pi*s2/2.)*(1.+special.erf(x))
+
+def _ppfLognormal(n,norm,logmo,s2):
+    """Inverse of _cdfLognormal"""
+    x= special.erfinv(n/norm/numpy.sqrt(numpy.pi*s2/2.)-1.)
+    return 10.**(logmo+x*numpy.sqrt(2.*s2))
+
+def _cdfLognormalChabrier2001(m):
+    return _cdfLognormal(m,0.141,_LOGMOLOGNORMALCHABRIER2001,
+                         _S2LOGNORMALCHABRIER2001)
+
+def _cdfExponentialChabrier2001(m):
+    #substituting t= (mo/m)^beta gives an incomplete gamma function
+    s= (_ALPHAEXPONENTIALCHABRIER2001-1.)/_BETAEXPONENTIALCHABRIER2001
+    with numpy.errstate(divide='ignore'):
+        t= (_MOEXPONENTIALCHABRIER2001/m)**_BETAEXPONENTIALCHABRIER2001
+    return 3.*_MOEXPONENTIALCHABRIER2001**(1.-_ALPHAEXPONENTIALCHABRIER2001)\
+        /_BETAEXPONENTIALCHABRIER2001*special.gamma(s)*special.gammaincc(s,t)
+
+def _ppfLognormalChabrier2001(n):
+    return _ppfLognormal(n,0.141,_LOGMOLOGNORMALCHABRIER2001,
+                         _S2LOGNORMALCHABRIER2001)
+
+def _ppfExponentialChabrier2001(n):
+    s= (_ALPHAEXPONENTIALCHABRIER2001-1.)/_BETAEXPONENTIALCHABRIER2001
+    t= special.gammainccinv(s,n/(3.*_MOEXPONENTIALCHABRIER2001\
+                                     **(1.-_ALPHAEXPONENTIALCHABRIER2001)\
+                                     /_BETAEXPONENTIALCHABRIER2001\
+                                     *special.gamma(s)))
+    with numpy.errstate(divide='ignore'):
+        return _MOEXPONENTIALCHABRIER2001*t**(-1./_BETAEXPONENTIALCHABRIER2001)
+
+def _cdfKroupa2003(m):
+    return _cdfPowerlaw(m,_KROUPA2003EDGES,_KROUPA2003SLOPES,
+                        _KROUPA2003COEFFS)
+
+def _cdfChabrier2003(m):
+    return _cdfLognormal(numpy.minimum(m,1.),0.158,
+                         _LOGMOLOGNORMALCHABRIER2003,_S2LOGNORMALCHABRIER2003)\
+        +_cdfPowerlaw(numpy.maximum(m,1.),numpy.array([1.,numpy.inf]),
+                      numpy.array([2.3]),numpy.array([_CHABRIER2003PL]))
+
+def _ppfKroupa2003(n):
+    return _ppfPowerlaw(n,_KROUPA2003EDGES,_KROUPA2003SLOPES,
+                        _KROUPA2003COEFFS)
+
+def _ppfChabrier2003(n):
+    none= _cdfChabrier2003(numpy.array([1.]))[0]
+    return numpy.where(n < none,
+                       _ppfLognormal(numpy.minimum(n,none),0.158,
+                                     _LOGMOLOGNORMALCHABRIER2003,
+                                     _S2LOGNORMALCHABRIER2003),
+                       _ppfPowerlaw(numpy.maximum(n-none,0.),
+                                    numpy.array([1.,numpy.inf]),
+                                    numpy.array([2.3]),
+                                    numpy.array([_CHABRIER2003PL])))
+
+_CDFS= {lognormalChabrier2001:_cdfLognormalChabrier2001,
+        exponentialChabrier2001:_cdfExponentialChabrier2001,
+        kroupa2003:_cdfKroupa2003,
+        chabrier2003:_cdfChabrier2003}
+_PPFS= {lognormalChabrier2001:_ppfLognormalChabrier2001,
+        exponentialChabrier2001:_ppfExponentialChabrier2001,
+        kroupa2003:_ppfKroupa2003,
+        chabrier2003:_ppfChabrier2003}
@@ -0,0 +1,135 @@
+###############################################################################
+#   isodist.synthesis: synthetic stellar populations drawn from isochrones
+#
+#   Quick start guide
+#   -----------------
+#
+#   >>>for stars in synthesize(10**9,dist=(ds,pdf),iso=p,imf='kroupa2003'):
+#   ...    (do something with the structured array stars)
+#
+#   Ages and metallicities are drawn from the isochrone grid (weighted by
+#   ageprior= and logprior=, as for eval_distpdf), masses from the IMF, and
+#   logg, Teff, and absolute magnitudes are interpolated in initial mass
+#   along the isochrones; stars that have died are dropped
+###############################################################################
+import numpy
+from isodist import imf as imfs
+from isodist._isodist import _load_grid, _parse_observations, \
+    _cell_logprior, _distmodulus
+_CHUNKSIZE= 2**20
+def synthesize(n,dist,padova=None,padova_type=None,iso=None,
+               imf='kroupa2003',ageprior=None,logprior=None,
+               mmin=None,mmax=None,filters=None,
+               chunksize=_CHUNKSIZE,rng=None):
+    """
+    NAME:
+       synthesize
+    PURPOSE:
+       draw a synthetic stellar population, in chunks
+    INPUT:
+       n - number of (living) stars to draw
+       dist - distance distribution, in kpc:
+              - a single distance
+              - (ds,pdf): tabulated distance PDF (e.g., from eval_distpdf,
+                after exponentiating), linearly interpolated
+              - function dist(n,rng) that returns n distances
+       padova=, padova_type=, iso= isochrones to use, as for eval_distpdf
+       imf= ('kroupa2003') IMF to draw the initial masses from: name of an
+            IMF in isodist.imf or function that returns dN/dM (see
+            isodist.imf.sample)
+       ageprior= - None: flat in log age
+                 - flat: flat in age
+       logprior= log prior for each isochrone, shape (nZ,nage), added to
+                 the age prior (e.g., a metallicity distribution evaluated
+                 at the grid's Zs)
+       mmin=, mmax= range of initial masses to draw (default: the range of
+                    the isochrone grid); stars outside of the mass range of
+                    their isochrone are dropped
+       filters= list of filters (default: all filters of the grid)
+       chunksize= number of stars in each chunk (bounds the memory use)
+       rng= numpy.random.Generator or seed for numpy.random.default_rng
+    OUTPUT:
+       generator of structured arrays with fields logage, Z, mass (initial),
+       dist (kpc), logg, Teff, absolute magnitudes M_<filter>, and apparent
+       magnitudes <filter> (chunksize stars, n in total)
+    HISTORY:
+       2026-10-17 - Written - agent
+    """
+    grid= _load_grid(padova,padova_type,iso)
+    if filters is None: filters= grid.filters()
+    if not isinstance(rng,numpy.random.Generator):
+        rng= numpy.random.default_rng(rng)
+    imf= imfs._lookup(imf)
+    #Probability of each isochrone
+    obs= _parse_observations({},{},None,None,None,None,None,None,None,None,
+                             None,None,None,None,logprior)
+    logp= _cell_logprior(grid,obs,ageprior)[0].flatten()
+    logp[grid.npts().flatten() < 2]= -numpy.inf
+    prob= numpy.exp(logp-numpy.amax(logp))
+    prob/= numpy.sum(prob)
+    nage= len(grid.logages())
+    masses= grid[grid._masskey][grid.validmask()]
+    if mmin is None: mmin= numpy.amin(masses)
+    if mmax is None: mmax= numpy.amax(masses)
+    keys= ['logg','logTe']+list(filters)
+    dtype= [('logage','f8'),('Z','f8'),('mass','f8'),('dist','f8'),
+            ('logg','f8'),('Teff','f8')]\
+            +[('M_'+f,'f8') for f in filters]+[(f,'f8') for f in filters]
+    ndrawn, nalive= 0, 0
+    for start in range(0,n,chunksize):
+        size= min(chunksize,n-start)
+        out= numpy.empty(size,dtype=dtype)
+        filled= 0
+        while filled < size:
+            #Draw enough stars to fill the chunk given the fraction that is
+            #alive so far
+            ndraw= min(chunksize,
+                       int(numpy.ceil((size-filled)*1.05*(ndrawn+1)
+                                      /(nalive+1)))+16)
+            cells= rng.choice(len(prob),size=ndraw,p=prob)
+            mass= imfs.sample(imf,ndraw,mmin,mmax,rng=rng)
+            cols= grid.interpolate(cells,mass,keys)
+            alive= numpy.flatnonzero(numpy.isfinite(cols['logTe']))
+            ndrawn+= ndraw
+            nalive+= len(alive)
+            if nalive == 0 and ndrawn >= 100*chunksize:
+                raise ValueError("None of the stars drawn between mmin and mmax are alive")
+            alive= alive[:size-filled]
+            new= slice(filled,filled+len(alive))
+            out['logage'][new]= grid.logages()[cells[alive] % nage]
+            out['Z'][new]= grid.Zs()[cells[alive] // nage]
+            out['mass'][new]= mass[alive]
+            out['logg'][new]= cols['logg'][alive]
+            out['Teff'][new]= 10.**cols['logTe'][alive]
+            for f in filters:
+                out['M_'+f][new]= cols[f][alive]
+            filled+= len(alive)
+        out['dist']= _sample_distances(dist,size,rng)
+        distmod= _distmodulus(out['dist'])
+        for f in filters:
+            out[f]= out['M_'+f]+distmod
+        yield out
+
+def _sample_distances(dist,n,rng):
+    """Draw n distances from a distance, tabulated PDF, or function"""
+    if callable(dist):
+        return numpy.asarray(dist(n,rng),dtype='float')
+    elif isinstance(dist,(tuple,list)):
+        ds, pdf= numpy.asarray(dist[0],dtype='float'), \
+            numpy.asarray(dist[1],dtype='float')
+        cdf= numpy.zeros(len(ds))
+        cdf[1:]= numpy.cumsum(0.5*(pdf[1:]+pdf[:-1])*(ds[1:]-ds[:-1]))
+        u= rng.random(n)*cdf[-1]
+        #invert the piecewise-quadratic CDF within each interval
+        indx= numpy.clip(numpy.searchsorted(cdf,u,side='right')-1,
+                         0,len(ds)-2)
+        dd= ds[indx+1]-ds[indx]
+        slope= (pdf[indx+1]-pdf[indx])/dd
+        du= u-cdf[indx]
+        with numpy.errstate(divide='ignore',invalid='ignore'):
+            step= 2.*du/(pdf[indx]+numpy.sqrt(numpy.maximum(pdf[indx]**2.
+                                                            +2.*slope*du,
+                                                            0.)))
+        return ds[indx]+numpy.clip(numpy.nan_to_num(step),0.,dd)
+    else:
+        return numpy.full(n,float(dist))